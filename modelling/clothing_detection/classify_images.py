@@ -1,14 +1,38 @@
 import os
+import sys
 import json
+import time
+import hashlib
 import logging
-from config import LOG_FILE_CLASSIFY, LOGGING_LEVEL, FORCE_RECALCULATE_SCORES, DATA_FOLDERS
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from config import (
+    LOG_FILE_CLASSIFY, LOGGING_LEVEL, FORCE_RECALCULATE_SCORES, DATA_FOLDERS, STORAGE_BACKEND, STORAGE_PATH,
+    MEDIA_STORE_FOLDER, SCORE_CACHE_FILE, ENABLED_MODELS, SCORE_CHUNK_SIZE, EMBEDDING_CACHE_FOLDER,
+    EVICT_UNUSED_EMBEDDINGS, CASCADE_MODE, CASCADE_UNCERTAIN_BAND, MODEL_RELATIVE_COST, MODEL_REGISTRY, PROMPTS,
+    MANIFEST_FILE, CHECKPOINT_EVERY, WATCH_MODE, WATCH_INTERVAL, BATCH_SIZE, NUM_WORKERS, TORCH_THREADS_PER_WORKER,
+    TAXONOMY_FILE, TAXONOMY_MODEL
+)
 try:
-    from modelling.clothing_detection.model_utils import classify_image_clip_base, classify_image_clip_large
+    from modelling.clothing_detection.model_utils import (
+        embed_images_stream, score_embeddings, text_head, backend_id, init_worker, embed_shard
+    )
+    from modelling.clothing_detection import embedding_cache, taxonomy
 except ImportError:
     try:
-        from clothing_detection.model_utils import classify_image_clip_base, classify_image_clip_large
+        from clothing_detection.model_utils import (
+            embed_images_stream, score_embeddings, text_head, backend_id, init_worker, embed_shard
+        )
+        from clothing_detection import embedding_cache, taxonomy
     except ImportError:
-        from model_utils import classify_image_clip_base, classify_image_clip_large
+        from model_utils import (
+            embed_images_stream, score_embeddings, text_head, backend_id, init_worker, embed_shard
+        )
+        import embedding_cache
+        import taxonomy
+# Корень репозитория - для импорта общих модулей parsing/ при запуске скрипта напрямую
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from parsing import storage, media_store
 
 
 logging.basicConfig(
@@ -19,69 +43,627 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-def process_json_files():
+PATH_DIGESTS_FILE = os.path.join(EMBEDDING_CACHE_FOLDER, 'paths.json')
+# Поколение незавершенного принудительного пересчета (удаляется, когда пересчет пройден до конца)
+FORCED_PASS_FILE = MANIFEST_FILE + '.forced'
+# Манифест постов хранилища STORAGE_BACKEND (sqlite, jsonl): ключ - platform/channel/post_id
+STORAGE_MANIFEST_FILE = os.path.splitext(MANIFEST_FILE)[0] + '_storage.json'
+
+_path_digests = None  # путь -> [mtime, хэш], чтобы не хэшировать неизмененные файлы при каждом запуске
+_seen_digests = set()  # хэши изображений, на которые ссылаются посты (для очистки кэша эмбеддингов)
+_model_timings = {}  # модель -> [изображений, секунд] - время расчета эмбеддингов в этом запуске
+_text_heads = {}  # (модель, промпты) -> (эмбеддинги промптов, масштаб логитов)
+
+# Пересчет всех скоров; в режиме наблюдения - только на первом проходе
+force_recalculate = FORCE_RECALCULATE_SCORES
+
+_worker_pool = None
+
+def media_digest(media_path):
+    """Хэш содержимого файла (пересчитывается только при изменении mtime файла)."""
+    global _path_digests
+    if _path_digests is None:
+        _path_digests = {}
+        if os.path.exists(PATH_DIGESTS_FILE):
+            with open(PATH_DIGESTS_FILE, 'r', encoding='utf-8') as f:
+                _path_digests = json.load(f)
+    mtime = os.path.getmtime(media_path)
+    entry = _path_digests.get(media_path)
+    if entry is None or entry[0] != mtime:
+        entry = _path_digests[media_path] = [mtime, media_store.media_digest(media_path)]
+    _seen_digests.add(entry[1])
+    return entry[1]
+
+def rescore_cached_embeddings(score_cache):
+    """
+    Пересчет скоров по сохраненным эмбеддингам (например, после смены PROMPTS): матричное
+    умножение по кэшу без запуска vision-башни. Изображения без эмбеддинга будут посчитаны при обходе постов.
+    """
+    for name in ENABLED_MODELS:
+        if not os.path.exists(os.path.join(EMBEDDING_CACHE_FOLDER, name, 'index.json')):
+            continue
+        cache = embedding_cache.get_embedding_cache(name)
+        for digests, embeddings in cache.items():
+            for digest, prob in zip(digests, score_embeddings(name, embeddings, head=get_text_head(name, PROMPTS))):
+                score_cache.setdefault(digest, {})[name] = prob
+        logger.info(f"Скоры {name} пересчитаны по кэшу эмбеддингов: {len(cache)}")
+
+def load_score_cache():
+    """Скоры уже классифицированных изображений по хэшу содержимого: {хэш: {имя модели: скор}}."""
+    if os.path.exists(SCORE_CACHE_FILE) and not force_recalculate:
+        with open(SCORE_CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    score_cache = {}
+    if force_recalculate:
+        rescore_cached_embeddings(score_cache)
+    return score_cache
+
+def save_score_cache(score_cache, referenced=None):
+    """
+    Сохраняет кэш скоров, кэши эмбеддингов и хэши файлов. Если передан referenced (хэши изображений,
+    на которые ссылаются посты), эмбеддинги и хэши остальных изображений удаляются.
+    """
+    for cache in embedding_cache.opened_caches().values():
+        if EVICT_UNUSED_EMBEDDINGS and referenced is not None:
+            cache.evict(referenced)
+        cache.flush()
+    if _path_digests is not None:
+        os.makedirs(EMBEDDING_CACHE_FOLDER, exist_ok=True)
+        with open(PATH_DIGESTS_FILE + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({
+                path: entry for path, entry in _path_digests.items() if referenced is None or entry[1] in referenced
+            }, f)
+        os.replace(PATH_DIGESTS_FILE + '.tmp', PATH_DIGESTS_FILE)
+
+    tmp_path = SCORE_CACHE_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(score_cache, f, ensure_ascii=False)
+    os.replace(tmp_path, SCORE_CACHE_FILE)
+
+def required_models(scores):
+    """
+    Модели, скоры которых еще нужны изображению. В каскадном режиме (CASCADE_MODE) модели ENABLED_MODELS
+    запускаются по очереди: следующая - только если скор предыдущей попал в CASCADE_UNCERTAIN_BAND.
+    """
+    if not CASCADE_MODE:
+        return [name for name in ENABLED_MODELS if name not in scores]
+    low, high = CASCADE_UNCERTAIN_BAND
+    for name in ENABLED_MODELS:
+        if name not in scores:
+            return [name]
+        if scores[name] is None or not low <= scores[name] <= high:
+            return []
+    return []
+
+def cascade_decision(scores):
+    """Итоговый скор каскада и модель, которая его определила (скор None - файл поврежден)."""
+    low, high = CASCADE_UNCERTAIN_BAND
+    for name in ENABLED_MODELS:
+        prob = scores.get(name)
+        if prob is None or not low <= prob <= high or name == ENABLED_MODELS[-1]:
+            return prob, name
+
+def score_image(media_path, score_cache):
+    """
+    Скоры изображения моделями из ENABLED_MODELS. Изображение с тем же содержимым (репост в другом канале
+    или на другой платформе) классифицируется один раз, дальше скоры берутся из кэша по хэшу.
+    """
+    digest = media_digest(media_path)
+    scores = score_cache.setdefault(digest, {})
+    if required_models(scores) or needs_taxonomy(scores):
+        score_images({digest: media_path}, score_cache)
+    return scores
+
+def needs_taxonomy(scores):
+    """Нужны ли изображению метки таксономии (TAXONOMY_FILE задан, а меток текущей версии таксономии нет)."""
+    return bool(TAXONOMY_FILE) and (scores.get('taxonomy') or {}).get('version') != taxonomy.taxonomy_version()
+
+def get_worker_pool():
     """
-    Обрабатывает JSON-файлы в указанных директориях, выполняя классификацию изображений на наличие одежды
-    с использованием двух моделей CLIP: базовой и продвинутой версии.
+    Пул из NUM_WORKERS процессов для расчета эмбеддингов. Каждый процесс загружает модели один раз,
+    потоки torch делятся между процессами поровну (или TORCH_THREADS_PER_WORKER).
     """
+    global _worker_pool
+    if _worker_pool is None:
+        torch_threads = TORCH_THREADS_PER_WORKER or max(1, (os.cpu_count() or 1) // NUM_WORKERS)
+        _worker_pool = ProcessPoolExecutor(
+            max_workers=NUM_WORKERS,
+            # spawn, а не fork: fork процесса с уже запущенными потоками torch может зависнуть
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(torch_threads,)
+        )
+        logger.info(f"Запущено процессов классификации: {NUM_WORKERS}, потоков torch на процесс: {torch_threads}")
+    return _worker_pool
+
+def get_text_head(name, prompts):
+    """
+    Эмбеддинги промптов и масштаб логитов модели для скоров по эмбеддингам (один раз за запуск).
+    При NUM_WORKERS > 1 считаются в процессе пула: родительский процесс не загружает модели вовсе.
+    """
+    key = (name, tuple(prompts))
+    if key not in _text_heads:
+        if NUM_WORKERS > 1:
+            _text_heads[key] = get_worker_pool().submit(text_head, name, list(prompts)).result()
+        else:
+            _text_heads[key] = text_head(name, list(prompts))
+    return _text_heads[key]
+
+def sharded_embed(name, image_paths):
+    """Эмбеддинги изображений, рассчитанные пулом процессов: очередь делится на шарды по BATCH_SIZE."""
+    shards = [image_paths[start:start + BATCH_SIZE] for start in range(0, len(image_paths), BATCH_SIZE)]
+    for shard in get_worker_pool().map(embed_shard, [name] * len(shards), shards):
+        yield from shard
+
+def embed_images(name, image_paths):
+    """Пары (путь, эмбеддинг): в этом процессе или, если NUM_WORKERS > 1, в пуле процессов."""
+    if NUM_WORKERS > 1:
+        return sharded_embed(name, image_paths)
+    return embed_images_stream(name, image_paths)
+
+def log_throughput():
+    """Производительность расчета эмбеддингов за запуск (по всем процессам)."""
+    for name, (images, seconds) in _model_timings.items():
+        if images and seconds:
+            report = f"{name}: {images} изображений за {seconds:.1f} с ({images / seconds:.1f} изобр./с, процессов: {NUM_WORKERS})"
+            logger.info(report)
+            print(report)
+
+def cached_embeddings(name, todo):
+    """
+    Кэш эмбеддингов модели, в который досчитаны эмбеддинги изображений todo ([(хэш, путь)]) батчами.
+    Поврежденных файлов в кэше не будет.
+    """
+    cache = embedding_cache.get_embedding_cache(name)
+    missing = [(digest, path) for digest, path in todo if digest not in cache]
+    started = time.monotonic()
+    for (digest, _), (_, embedding) in zip(missing, embed_images(name, [path for _, path in missing])):
+        if embedding is not None:
+            cache.add(digest, embedding)
+    timing = _model_timings.setdefault(name, [0, 0.0])
+    timing[0] += len(missing)
+    timing[1] += time.monotonic() - started
+    return cache
+
+def score_images(images, score_cache):
+    """
+    Считает недостающие скоры изображений ({хэш: путь}) для каждой модели: эмбеддинги берутся
+    из кэша или считаются батчами (и сохраняются в кэш), затем скоры - одним матричным умножением.
+    Метки таксономии считаются так же по эмбеддингам TAXONOMY_MODEL.
+    Поврежденные файлы получают скор None и больше не классифицируются (до пересчета всех скоров).
+    """
+    for name in ENABLED_MODELS:
+        # В каскаде к моменту следующей модели уже известны скоры предыдущей
+        todo = [(digest, path) for digest, path in images.items() if name in required_models(score_cache.get(digest, {}))]
+        if not todo:
+            continue
+        cache = cached_embeddings(name, todo)
+        ready = [digest for digest, _ in todo if digest in cache]
+        scores = dict(zip(ready, score_embeddings(name, cache.get_many(ready), head=get_text_head(name, PROMPTS)))) if ready else {}
+        for digest, _ in todo:
+            score_cache.setdefault(digest, {})[name] = scores.get(digest)
+        cache.flush()
+
+    todo = [(digest, path) for digest, path in images.items() if needs_taxonomy(score_cache.get(digest, {}))]
+    if todo:
+        cache = cached_embeddings(TAXONOMY_MODEL, todo)
+        ready = [digest for digest, _ in todo if digest in cache]
+        head = get_text_head(TAXONOMY_MODEL, taxonomy.taxonomy_prompts()) if ready else None
+        labels = dict(zip(ready, taxonomy.score_taxonomy(cache.get_many(ready), head=head))) if ready else {}
+        for digest, _ in todo:
+            score_cache.setdefault(digest, {})['taxonomy'] = {
+                'version': taxonomy.taxonomy_version(),
+                'labels': labels.get(digest)
+            }
+        cache.flush()
+
+def post_media(message_data):
+    """Индексы и пути изображений поста."""
+    media = media_store.open_media_store(MEDIA_STORE_FOLDER)
+    for i, media_item in enumerate(message_data['media']):
+        # Проверяем, является ли media_item строкой пути к файлу
+        if isinstance(media_item, str):
+            media_path = media_item
+        elif isinstance(media_item, dict) and "file" in media_item:
+            media_path = media_item["file"]
+        else:
+            continue
+        # Фото, которое еще скачивалось при сохранении поста, указано идентификатором платформы
+        yield i, media.resolve(media_path)
+
+def has_scores(message_data, i):
+    """Есть ли у изображения i поста скоры всех моделей или итоговый скор каскада (и не требуется ли пересчет)."""
+    if force_recalculate:
+        return False
+    fields = ["media_clothing_score_cascade"] if CASCADE_MODE else [f"media_clothing_score_{name}" for name in ENABLED_MODELS]
+    for field in fields:
+        scores = message_data.get(field) or []
+        if i >= len(scores) or scores[i] is None:
+            return False
+    if TAXONOMY_FILE:
+        labels = message_data.get("media_taxonomy") or []
+        if message_data.get("media_taxonomy_version") != taxonomy.taxonomy_version():
+            return False
+        if i >= len(labels) or labels[i] is None:
+            return False
+    return True
+
+def pending_images(message_data, score_cache):
+    """Изображения поста, для которых нужно запускать модели: {хэш: путь}."""
+    images = {}
+    if "media" not in message_data:
+        return images
+    for i, media_path in post_media(message_data):
+        if not os.path.exists(media_path):
+            continue
+        digest = media_digest(media_path)
+        if has_scores(message_data, i):
+            continue
+        scores = score_cache.get(digest, {})
+        if required_models(scores) or needs_taxonomy(scores):
+            images[digest] = media_path
+    return images
+
+def score_post(message_data, score_cache):
+    """
+    Выполняет классификацию изображений поста на наличие одежды моделями из ENABLED_MODELS
+    (по умолчанию - базовая и продвинутая версии CLIP). В каскадном режиме дополнительно записывается
+    итоговый скор и модель, которая его определила, а при заданном TAXONOMY_FILE - метки таксономии
+    (поле media_taxonomy). Возвращает True, если скоры поста изменились.
+    """
+    if "media" not in message_data:
+        return False
+    updated = False  # Флаг для проверки, были ли изменения в посте
+
+    # Создание пустых списков для скоров, если они не существуют или нужно пересчитать
+    fields = {name: f"media_clothing_score_{name}" for name in ENABLED_MODELS}
+    cascade_field = "media_clothing_score_cascade"
+    for field in list(fields.values()) + ([cascade_field] if CASCADE_MODE else []):
+        if field not in message_data or force_recalculate:
+            message_data[field] = [None] * len(message_data["media"])
+    if TAXONOMY_FILE and (
+        message_data.get("media_taxonomy_version") != taxonomy.taxonomy_version() or force_recalculate
+    ):
+        message_data["media_taxonomy"] = [None] * len(message_data["media"])
+        message_data["media_taxonomy_version"] = taxonomy.taxonomy_version()
+        updated = True
+    # В пост могли добавиться медиа (объединение альбома, повторное сохранение): дополняем списки до длины media
+    for field in list(fields.values()) + ([cascade_field] if CASCADE_MODE else []) + (["media_taxonomy"] if TAXONOMY_FILE else []):
+        if len(message_data[field]) < len(message_data["media"]):
+            message_data[field] += [None] * (len(message_data["media"]) - len(message_data[field]))
+
+    # Проходим по каждому медиа-файлу
+    for i, media_path in post_media(message_data):
+        # Проверяем наличие предыдущих скоров и пересчитываем только если нужно
+        if has_scores(message_data, i):
+            logger.info(f"Скоры уже существуют для файла {media_path}, пропускаем.")
+            continue
+
+        if os.path.exists(media_path):
+            # Применяем модели (или берем скоры того же изображения из кэша)
+            scores = score_image(media_path, score_cache)
+            if any(name in scores and scores[name] is None for name in ENABLED_MODELS):
+                logger.warning(f"Файл поврежден, скоры не записаны: {media_path}")
+                continue
+            
+            # Запись скоринга для каждой модели (перезапись при необходимости); в каскаде не запущенные модели - None
+            for name, field in fields.items():
+                message_data[field][i] = (scores[name], media_path) if name in scores else None
+            if CASCADE_MODE:
+                prob, decided_by = cascade_decision(scores)
+                message_data[cascade_field][i] = (prob, decided_by, media_path)
+            if TAXONOMY_FILE and scores['taxonomy']['labels'] is not None:
+                message_data["media_taxonomy"][i] = (scores['taxonomy']['labels'], media_path)
+
+            updated = True
+            logger.info(f"Обработан файл {media_path} со скорами: " + ", ".join(f"{name}: {scores.get(name)}" for name in ENABLED_MODELS))
+        else:
+            logger.warning(f"Файл не найден: {media_path}")
+
+    return updated
+
+def log_cascade_report(score_cache):
+    """
+    Отчет каскада по изображениям постов этого запуска: какая модель определила скор и сколько
+    вычислений сэкономлено относительно запуска всех моделей на каждом изображении. Стоимость
+    изображения для модели - измеренное в этом запуске время, иначе MODEL_RELATIVE_COST.
+    """
+    decided = {name: 0 for name in ENABLED_MODELS}
+    for digest in _seen_digests:
+        prob, decided_by = cascade_decision(score_cache.get(digest, {}))
+        if prob is not None:
+            decided[decided_by] += 1
+    total = sum(decided.values())
+    if not total:
+        return
+
+    if all(_model_timings.get(name, [0])[0] for name in ENABLED_MODELS):
+        cost = {name: _model_timings[name][1] / _model_timings[name][0] for name in ENABLED_MODELS}
+    else:
+        cost = {name: MODEL_RELATIVE_COST.get(name, 1.0) for name in ENABLED_MODELS}
+    full_cost = total * sum(cost.values())
+    # Изображение, решенное моделью k, прошло через модели 0..k
+    cascade_cost = sum(
+        count * sum(cost[name] for name in ENABLED_MODELS[:position + 1])
+        for position, count in enumerate(decided.values())
+    )
+
+    report = (
+        f"Каскад: изображений {total}, " +
+        ", ".join(f"решено {name}: {count} ({count / total:.0%})" for name, count in decided.items()) +
+        f". Экономия вычислений относительно всех моделей: {1 - cascade_cost / full_cost:.0%}"
+    )
+    logger.info(report)
+    print(report)
+
+def classify_posts(posts, score_cache, on_processed):
+    """
+    Классифицирует посты батчами: изображения нескольких постов накапливаются до SCORE_CHUNK_SIZE
+    и прогоняются через модели вместе, затем скоры записываются в посты.
+    posts - итератор пар (ключ, данные поста); on_processed(ключ, данные, изменен ли пост) вызывается для каждого поста.
+    """
+    batch_posts, batch_images = [], {}
+
+    def flush():
+        score_images(batch_images, score_cache)
+        for key, message_data in batch_posts:
+            on_processed(key, message_data, score_post(message_data, score_cache))
+        batch_posts.clear()
+        batch_images.clear()
+
+    for key, message_data in posts:
+        batch_posts.append((key, message_data))
+        batch_images.update(pending_images(message_data, score_cache))
+        if len(batch_images) >= SCORE_CHUNK_SIZE:
+            flush()
+    flush()
+
+def scoring_version():
+    """Версия настроек классификации: при смене моделей, промптов, бэкенда, каскада или таксономии посты классифицируются заново."""
+    settings = {
+        'models': {name: MODEL_REGISTRY[name] for name in ENABLED_MODELS},
+        'prompts': PROMPTS,
+        'backend': {name: backend_id(name) for name in ENABLED_MODELS},
+        'cascade': list(CASCADE_UNCERTAIN_BAND) if CASCADE_MODE else None,
+        'taxonomy': taxonomy.taxonomy_version() if TAXONOMY_FILE else None
+    }
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+def load_manifest(path=MANIFEST_FILE):
+    """
+    Манифест обработанных JSON-файлов: путь -> {'mtime', 'size', 'version', 'digests'}.
+    Файл с теми же mtime и размером, уже классифицированный текущей версией настроек, не открывается.
+    Для постов хранилища (STORAGE_MANIFEST_FILE) вместо mtime и размера - отпечаток списка медиа.
+    """
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def save_manifest(manifest, path=MANIFEST_FILE):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def forced_generation():
+    """
+    Поколение принудительного пересчета (FORCE_RECALCULATE_SCORES): прерванный пересчет продолжается
+    с тем же поколением, поэтому уже пересчитанные в нем файлы не открываются повторно.
+    """
+    if os.path.exists(FORCED_PASS_FILE):
+        with open(FORCED_PASS_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)['generation']
+    generation = hashlib.sha1(f'{time.time()}:{os.getpid()}'.encode('utf-8')).hexdigest()[:12]
+    with open(FORCED_PASS_FILE, 'w', encoding='utf-8') as f:
+        json.dump({'generation': generation}, f)
+    return generation
+
+def referenced_digests(manifest):
+    """Хэши изображений всех известных постов (для очистки кэша эмбеддингов)."""
+    return _seen_digests.union(*(entry.get('digests', []) for entry in manifest.values()))
+
+def file_stat(file_path):
+    """(mtime, размер) файла или None, если файл удален."""
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+def iter_json_files(manifest, version, generation=None):
+    """
+    Новые и измененные посты из JSON-файлов в DATA_FOLDERS: пары ((путь к файлу, (mtime, размер) на момент
+    чтения), данные).
+    При принудительном пересчете - все файлы, кроме уже пересчитанных в поколении generation.
+    """
+    existing = set()
     for folder in DATA_FOLDERS:
         for root, dirs, files in os.walk(folder):
             for file in files:
                 if file.endswith(".json"):
                     file_path = os.path.join(root, file)
+                    existing.add(file_path)
+
+                    read_stat = file_stat(file_path)
+                    entry = manifest.get(file_path)
+                    if read_stat is None:
+                        continue
+                    if (
+                        entry and entry['version'] == version and
+                        (entry['mtime'], entry['size']) == read_stat and
+                        (not force_recalculate or entry.get('forced') == generation)
+                    ):
+                        continue
                     
                     logger.info(f"Начало обработки файла {file_path}")
                     
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        message_data = json.load(f)
-                    
-                    if "media" in message_data:
-                        updated = False  # Флаг для проверки, были ли изменения в JSON
-
-                        # Создание пустых списков для скоров, если они не существуют или нужно пересчитать
-                        if "media_clothing_score_CLIP_base" not in message_data or FORCE_RECALCULATE_SCORES:
-                            message_data["media_clothing_score_CLIP_base"] = [None] * len(message_data["media"])
-                        if "media_clothing_score_CLIP_large" not in message_data or FORCE_RECALCULATE_SCORES:
-                            message_data["media_clothing_score_CLIP_large"] = [None] * len(message_data["media"])
-
-                        # Проходим по каждому медиа-файлу
-                        for i, media_item in enumerate(message_data['media']):
-                            # Проверяем, является ли media_item строкой пути к файлу
-                            if isinstance(media_item, str):
-                                media_path = media_item
-                            elif isinstance(media_item, dict) and "file" in media_item:
-                                media_path = media_item["file"]
-                            else:
-                                continue
-
-                            # Проверяем наличие предыдущих скоров и пересчитываем только если нужно
-                            if (
-                                not FORCE_RECALCULATE_SCORES and
-                                message_data["media_clothing_score_CLIP_base"][i] is not None and
-                                message_data["media_clothing_score_CLIP_large"][i] is not None
-                            ):
-                                logger.info(f"Скоры уже существуют для файла {media_path}, пропускаем.")
-                                continue
-
-                            if os.path.exists(media_path):
-                                # Применяем базовую и продвинутую CLIP
-                                clothing_score_clip_base = classify_image_clip_base(media_path)
-                                clothing_score_clip_large = classify_image_clip_large(media_path)
-                                
-                                # Запись скоринга для каждой модели (перезапись при необходимости)
-                                message_data["media_clothing_score_CLIP_base"][i] = (clothing_score_clip_base, media_path)
-                                message_data["media_clothing_score_CLIP_large"][i] = (clothing_score_clip_large, media_path)
-
-                                updated = True
-                                logger.info(f"Обработан файл {media_path} с score CLIP base: {clothing_score_clip_base}, CLIP large: {clothing_score_clip_large}")
-                            else:
-                                logger.warning(f"Файл не найден: {media_path}")
-
-                        # Сохраняем обновленный JSON только если были изменения
-                        if updated:
-                            with open(file_path, 'w', encoding='utf-8') as f:
-                                json.dump(message_data, f, ensure_ascii=False, indent=4)
-                            logger.info(f"Файл {file_path} успешно обновлён")
+                    try:
+                        with open(file_path, 'r', encoding='utf-8') as f:
+                            message_data = json.load(f)
+                    except ValueError as e:
+                        logger.warning(f"Не удалось прочитать {file_path}: {e}")
+                        continue
+                    yield (file_path, read_stat), message_data
+
+    # Удаленные файлы убираем из манифеста
+    for file_path in set(manifest) - existing:
+        del manifest[file_path]
+
+def save_json_file(file_path, message_data):
+    # Сохраняем через временный файл, чтобы прерванная запись не оставила обрезанный JSON
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(message_data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, file_path)
+    logger.info(f"Файл {file_path} успешно обновлён")
+
+def process_json_files():
+    """
+    Обрабатывает новые и измененные (по манифесту) JSON-файлы в указанных директориях, выполняя
+    классификацию изображений на наличие одежды моделями из ENABLED_MODELS (батчами изображений
+    из нескольких файлов). Каждые CHECKPOINT_EVERY постов прогресс сохраняется, поэтому прерванный
+    запуск (в том числе принудительный пересчет) продолжается с места остановки.
+    """
+    score_cache = load_score_cache()
+    manifest = load_manifest()
+    version = scoring_version()
+    generation = forced_generation() if force_recalculate else None
+    processed = 0
+
+    def on_processed(key, message_data, updated):
+        nonlocal processed
+        file_path, read_stat = key
+        # Парсеры пишут в те же файлы (скачанное медиа, объединение альбома): если файл изменился после
+        # чтения, перечитываем его и применяем скоры заново, чтобы не затереть запись парсера старой копией
+        while updated and file_stat(file_path) != read_stat:
+            logger.info(f"Файл {file_path} изменен во время классификации, скоры применяются к новой версии")
+            read_stat = file_stat(file_path)
+            if read_stat is None:
+                return
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    message_data = json.load(f)
+            except ValueError as e:
+                logger.warning(f"Не удалось прочитать {file_path}: {e}")
+                return
+            updated = score_post(message_data, score_cache)
+        # Сохраняем обновленный JSON только если были изменения
+        if updated:
+            save_json_file(file_path, message_data)
+            read_stat = file_stat(file_path)
+        # Пост с еще не скачанными изображениями остается в очереди до следующего запуска.
+        # В манифест записывается версия файла, которая действительно классифицирована
+        media_paths = [media_path for _, media_path in post_media(message_data)] if "media" in message_data else []
+        if read_stat is not None and all(os.path.exists(media_path) for media_path in media_paths):
+            manifest[file_path] = {
+                'mtime': read_stat[0],
+                'size': read_stat[1],
+                'version': version,
+                'forced': generation,
+                'digests': sorted({media_digest(media_path) for media_path in media_paths})
+            }
+        processed += 1
+        if processed % CHECKPOINT_EVERY == 0:
+            save_score_cache(score_cache)
+            save_manifest(manifest)
+
+    classify_posts(iter_json_files(manifest, version, generation), score_cache, on_processed)
+    save_score_cache(score_cache, referenced_digests(manifest))
+    save_manifest(manifest)
+    if generation is not None:
+        os.remove(FORCED_PASS_FILE)
+    logger.info(f"Обработано новых и измененных файлов: {processed}")
+    log_throughput()
+    if CASCADE_MODE:
+        log_cascade_report(score_cache)
+
+def watch_json_files():
+    """Режим наблюдения: каждые WATCH_INTERVAL секунд классифицирует новые и измененные посты парсеров."""
+    global force_recalculate
+    while True:
+        process_json_files()
+        force_recalculate = False
+        time.sleep(WATCH_INTERVAL)
+
+def media_fingerprint(message_data):
+    """Отпечаток списка медиа поста: скоры поста зависят только от него и от версии настроек."""
+    media = json.dumps(message_data.get("media", []), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(media.encode('utf-8')).hexdigest()[:12]
+
+def process_storage_posts():
+    """
+    Классифицирует новые и измененные (по манифесту STORAGE_MANIFEST_FILE) посты из хранилища STORAGE_BACKEND.
+    Обновленные посты записываются пачками, каждые CHECKPOINT_EVERY постов сохраняются записанные посты,
+    кэш скоров и манифест, поэтому прерванный запуск продолжается с места остановки.
+    """
+    store = storage.open_storage(STORAGE_BACKEND, STORAGE_PATH)
+    score_cache = load_score_cache()
+    manifest = load_manifest(STORAGE_MANIFEST_FILE)
+    version = scoring_version()
+    generation = forced_generation() if force_recalculate else None
+    existing = set()
+    processed = updated_count = 0
+
+    def iter_posts():
+        # Обновленные посты пишутся во время обхода: запись меняет только данные поста, но не ключ и дату,
+        # поэтому выборка не сдвигается (пост, прочитанный повторно, просто пропускается)
+        for platform, channel, post_id, message_data in store.query():
+            key = f"{platform}/{channel}/{post_id}"
+            existing.add(key)
+            entry = manifest.get(key)
+            if (
+                entry and entry['version'] == version and entry['fingerprint'] == media_fingerprint(message_data) and
+                (not force_recalculate or entry.get('forced') == generation)
+            ):
+                continue
+            logger.info(f"Начало обработки поста {key}")
+            yield (platform, channel, post_id), message_data
+
+    with storage.BulkWriter(store) as writer:
+        def on_processed(key, message_data, updated):
+            nonlocal processed, updated_count
+            if updated:
+                writer.add(*key, message_data)
+                updated_count += 1
+            # Пост с еще не скачанными изображениями остается в очереди до следующего запуска
+            media_paths = [media_path for _, media_path in post_media(message_data)] if "media" in message_data else []
+            if all(os.path.exists(media_path) for media_path in media_paths):
+                manifest["/".join(key)] = {
+                    'fingerprint': media_fingerprint(message_data),
+                    'version': version,
+                    'forced': generation,
+                    'digests': sorted({media_digest(media_path) for media_path in media_paths})
+                }
+            processed += 1
+            if processed % CHECKPOINT_EVERY == 0:
+                # Сначала посты, затем манифест: после сбоя пост может быть классифицирован повторно, но не потерян
+                writer.flush()
+                save_score_cache(score_cache)
+                save_manifest(manifest, STORAGE_MANIFEST_FILE)
+
+        classify_posts(iter_posts(), score_cache, on_processed)
+
+    # Удаленные посты убираем из манифеста
+    for key in set(manifest) - existing:
+        del manifest[key]
+    save_score_cache(score_cache, referenced_digests(manifest))
+    save_manifest(manifest, STORAGE_MANIFEST_FILE)
+    if generation is not None:
+        os.remove(FORCED_PASS_FILE)
+    logger.info(f"Обработано новых и измененных постов: {processed}, обновлено в хранилище: {updated_count}")
+    log_throughput()
+    if CASCADE_MODE:
+        log_cascade_report(score_cache)
 
 if __name__ == "__main__":
-    process_json_files()
+    try:
+        if STORAGE_BACKEND != "json":
+            process_storage_posts()
+        elif WATCH_MODE:
+            watch_json_files()
+        else:
+            process_json_files()
+    finally:
+        if _worker_pool is not None:
+            _worker_pool.shutdown()
\ No newline at end of file
@@ -6,8 +6,91 @@ LOG_FILE_CLASSIFY = "modelling/clothing_detection/classify_images.log"
 # Уровень логирования (может быть INFO, DEBUG, WARNING и т.д.)
 LOGGING_LEVEL = "INFO"
 
-# Принудительный пересчёт всех скоров (если True, пересчитываются все скоры, даже если они уже существуют)
+# Принудительный пересчёт всех скоров (если True, пересчитываются все скоры, даже если они уже существуют).
+# Эмбеддинги изображений при этом берутся из кэша EMBEDDING_CACHE_FOLDER, заново считаются только скоры по PROMPTS
 FORCE_RECALCULATE_SCORES = True # False - default
 
 # Пути к папкам с данными (JSON, внутри папка media с фотографиями)
 DATA_FOLDERS = ["parsing/telegram_parser/data", "parsing/instagram_parser/data"]
+
+# Хранилище постов парсеров (см. parsing/storage.py): 'json' - JSON-файлы в DATA_FOLDERS,
+# 'sqlite' или 'jsonl' - общее хранилище по пути STORAGE_PATH (скоры записываются обратно пачками)
+STORAGE_BACKEND = "json"
+STORAGE_PATH = "parsing/data/posts.sqlite"
+
+# Общее хранилище медиа парсеров по хэшу содержимого (для фото, которые еще скачивались при сохранении поста)
+MEDIA_STORE_FOLDER = "parsing/data/media"
+
+# Кэш скоров по хэшу содержимого изображения: одинаковые изображения классифицируются один раз
+SCORE_CACHE_FILE = "modelling/clothing_detection/scores_by_hash.json"
+
+# Модели классификации: имя (используется в названии поля скоров media_clothing_score_<имя>) -> чекпоинт CLIP
+MODEL_REGISTRY = {
+    "CLIP_base": "openai/clip-vit-base-patch32",
+    "CLIP_large": "openai/clip-vit-large-patch14",
+}
+
+# Какие модели запускать (модели загружаются только при первом изображении, которому нужен их скор)
+ENABLED_MODELS = ["CLIP_base", "CLIP_large"]
+
+# Бюджет памяти на загруженные модели в МБ (None - без ограничения); при превышении выгружаются давно не использовавшиеся
+MODEL_MEMORY_BUDGET_MB = None
+
+# Промпты классификации (скор - вероятность первого промпта); их эмбеддинги считаются один раз на модель
+PROMPTS = ["Is clothes", "Is not clothes"]
+
+# Сколько изображений (из разных постов) прогоняется через модель одним батчем
+BATCH_SIZE = 32
+
+# Сколько изображений накапливается из постов перед запуском моделей (внутри - батчи по BATCH_SIZE)
+SCORE_CHUNK_SIZE = 512
+
+# Потоки декодирования и предобработки изображений и на сколько батчей вперед они работают
+DECODE_WORKERS = 4
+PREFETCH_BATCHES = 2
+
+# Кэш эмбеддингов изображений (memmap на модель) - пересчет скоров после смены промптов без запуска моделей
+EMBEDDING_CACHE_FOLDER = "modelling/clothing_detection/embeddings"
+EMBEDDING_DTYPE = "float16"  # float16 - вдвое меньше места, на скоры практически не влияет
+EVICT_UNUSED_EMBEDDINGS = True  # Удалять эмбеддинги изображений, на которые больше не ссылается ни один пост
+
+# Каскадный режим: модели ENABLED_MODELS запускаются по очереди (от дешевой к дорогой), следующая -
+# только если скор предыдущей попал в интервал неопределенности. Итоговый скор и модель, которая его
+# определила, записываются в поле media_clothing_score_cascade
+CASCADE_MODE = False
+CASCADE_UNCERTAIN_BAND = (0.2, 0.8)
+
+# Относительная стоимость изображения для моделей (для отчета каскада, если время не измерено в запуске)
+MODEL_RELATIVE_COST = {"CLIP_base": 1.0, "CLIP_large": 10.0}
+
+# Манифест обработанных JSON-файлов (путь, mtime, размер, версия настроек классификации):
+# классифицируются только новые и измененные посты, прогресс сохраняется каждые CHECKPOINT_EVERY постов
+MANIFEST_FILE = "modelling/clothing_detection/manifest.json"
+CHECKPOINT_EVERY = 200
+
+# Режим наблюдения: папки DATA_FOLDERS проверяются каждые WATCH_INTERVAL секунд, новые посты парсеров классифицируются сразу
+WATCH_MODE = False
+WATCH_INTERVAL = 60
+
+# Шардированная классификация: эмбеддинги изображений считают NUM_WORKERS процессов (1 - в текущем процессе).
+# Потоки torch на процесс - TORCH_THREADS_PER_WORKER (None - ядра поровну между процессами)
+NUM_WORKERS = 1
+TORCH_THREADS_PER_WORKER = None
+
+# Бэкенд инференса image-энкодера: "torch" (fp32), "torch_int8" (динамическая int8-квантизация Linear-слоев),
+# "onnx" или "onnx_int8" (ONNX Runtime на CPU, граф fp32 или int8; графы экспортируются один раз:
+# python inference_backends.py export). Смена бэкенда или графа сбрасывает кэш эмбеддингов
+INFERENCE_BACKEND = "torch"
+ONNX_FOLDER = "modelling/clothing_detection/onnx"
+ONNX_INT8 = False  # "onnx" с квантованным в int8 графом (то же, что "onnx_int8")
+
+# Изображения для проверки расхождения скоров бэкендов с fp32 (python inference_backends.py parity)
+PARITY_IMAGES_FOLDER = "modelling/clothing_detection/parity_images"
+
+# Таксономия для многометочной классификации (группы меток: тип одежды, цвет, стиль...), например
+# "modelling/clothing_detection/taxonomy.json"; None - отключена. Изображение сравнивается со всеми метками
+# одним матричным умножением по эмбеддингу модели TAXONOMY_MODEL, в пост записываются TAXONOMY_TOP_K
+# самых вероятных меток каждой группы (поле media_taxonomy)
+TAXONOMY_FILE = None
+TAXONOMY_MODEL = "CLIP_base"
+TAXONOMY_TOP_K = 3
@@ -0,0 +1,169 @@
+import os
+import json
+import logging
+import threading
+import numpy as np
+try:
+    from modelling.clothing_detection import config, model_utils
+except ImportError:
+    try:
+        from clothing_detection import config, model_utils
+    except ImportError:
+        import config
+        import model_utils
+
+
+# Кэш нормированных эмбеддингов изображений на диске: для каждой модели - массив
+# <EMBEDDING_CACHE_FOLDER>/<модель>/embeddings.bin (np.memmap, строка на изображение) и индекс
+# index.json (хэш содержимого -> номер строки). Эмбеддинг изображения не зависит от промптов,
+# поэтому после смены PROMPTS пересчет скоров - одно матричное умножение по кэшу, без vision-башни.
+# Кэш сбрасывается при смене версии модели (чекпоинт и его ревизия), а строки изображений,
+# на которые больше не ссылается ни один пост, удаляются при уплотнении (evict).
+# Пишет в кэш только один процесс (классификатор); другие процессы (например, индекс поиска похожих)
+# открывают его read_only. Уплотненный или сброшенный кэш записывается в новый файл embeddings-<N>.bin,
+# и index.json переключается на него атомарно, поэтому читатель всегда видит согласованную пару файлов.
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """Эмбеддинги одной модели: memmap размером capacity x dim и индекс хэш -> строка."""
+
+    def __init__(self, folder, version, dim, dtype='float16', initial_capacity=1024, read_only=False):
+        self.folder = folder
+        self.index_file = os.path.join(folder, 'index.json')
+        self.dtype = np.dtype(dtype)
+        self.read_only = read_only
+        self.data = None
+
+        index = None
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        matches = index and (index['version'], index['dim'], index['dtype']) == (version, dim, self.dtype.name)
+        if read_only:
+            # Снимок кэша другого процесса: версия не совпадает - кэш считается пустым, на диск ничего не пишется
+            self.index = index if matches else {'version': version, 'dim': dim, 'dtype': self.dtype.name, 'capacity': 0, 'rows': {}}
+            self.data_file = os.path.join(folder, self.index.get('data_file', 'embeddings.bin'))
+            if self.index['rows']:
+                self.data = np.memmap(self.data_file, dtype=self.dtype, mode='r', shape=(self.index['capacity'], dim))
+            return
+
+        os.makedirs(folder, exist_ok=True)
+        if not matches:
+            if index:
+                logger.info(f"Версия модели изменилась ({index['version']} -> {version}), кэш эмбеддингов {folder} сброшен")
+            index = {
+                'version': version, 'dim': dim, 'dtype': self.dtype.name, 'capacity': 0, 'rows': {},
+                'data_file': self.next_data_file(index)
+            }
+        self.index = index
+        self.data_file = os.path.join(folder, index.get('data_file', 'embeddings.bin'))
+        self.open(max(index['capacity'], initial_capacity))
+        if not matches:
+            self.flush()
+            self.remove_stale_files()
+
+    def next_data_file(self, index):
+        """Имя нового файла эмбеддингов (старый удаляется только после переключения на новый index.json)."""
+        current = (index or {}).get('data_file', 'embeddings.bin')
+        number = int(current[len('embeddings-'):-len('.bin')]) + 1 if current.startswith('embeddings-') else 1
+        return f'embeddings-{number}.bin'
+
+    def remove_stale_files(self):
+        """
+        Удаляет файлы эмбеддингов, на которые больше не указывает index.json. Читатели, уже открывшие
+        старый файл, продолжают видеть свой снимок (файл удаляется из каталога, а не изменяется).
+        """
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if name.startswith('embeddings') and name.endswith('.bin') and path != self.data_file:
+                os.remove(path)
+
+    def open(self, capacity):
+        """Открывает (и при необходимости увеличивает) файл эмбеддингов на capacity строк."""
+        if self.data is not None:
+            self.data.flush()
+            self.data = None
+        with open(self.data_file, 'ab') as f:
+            size = capacity * self.index['dim'] * self.dtype.itemsize
+            if f.tell() < size:
+                f.truncate(size)
+        self.data = np.memmap(self.data_file, dtype=self.dtype, mode='r+', shape=(capacity, self.index['dim']))
+        self.index['capacity'] = capacity
+
+    def __len__(self):
+        return len(self.index['rows'])
+
+    def __contains__(self, digest):
+        return digest in self.index['rows']
+
+    def get_many(self, digests):
+        """Эмбеддинги (float32) для списка хэшей, которые есть в кэше."""
+        rows = [self.index['rows'][digest] for digest in digests]
+        return np.asarray(self.data[rows], dtype=np.float32)
+
+    def add(self, digest, embedding):
+        rows = self.index['rows']
+        if digest not in rows:
+            if len(rows) >= self.index['capacity']:
+                self.open(self.index['capacity'] * 2)
+            rows[digest] = len(rows)
+        self.data[rows[digest]] = embedding
+
+    def items(self, chunk_size=65536):
+        """Перебор кэша порциями: (список хэшей, матрица эмбеддингов float32)."""
+        digests = sorted(self.index['rows'], key=self.index['rows'].get)
+        for start in range(0, len(digests), chunk_size):
+            chunk = digests[start:start + chunk_size]
+            yield chunk, np.asarray(self.data[start:start + len(chunk)], dtype=np.float32)
+
+    def flush(self):
+        self.data.flush()
+        tmp_path = self.index_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_file)
+
+    def evict(self, keep):
+        """Уплотняет кэш, оставляя только эмбеддинги с хэшами из keep."""
+        kept = [digest for digest in sorted(self.index['rows'], key=self.index['rows'].get) if digest in keep]
+        if len(kept) == len(self.index['rows']):
+            return 0
+        evicted = len(self.index['rows']) - len(kept)
+        vectors = self.get_many(kept)
+        self.data.flush()
+        self.data = None
+        self.index['data_file'] = self.next_data_file(self.index)
+        self.data_file = os.path.join(self.folder, self.index['data_file'])
+        self.index['rows'] = {}
+        self.index['capacity'] = 0
+        self.open(max(len(kept), 1024))
+        for digest, vector in zip(kept, vectors):
+            self.add(digest, vector)
+        self.flush()
+        self.remove_stale_files()
+        logger.info(f"Из кэша эмбеддингов {self.folder} удалено записей: {evicted}")
+        return evicted
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_embedding_cache(name):
+    """Кэш эмбеддингов модели name (открывается один раз на процесс; загружает модель для версии и размерности)."""
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = EmbeddingCache(
+                os.path.join(config.EMBEDDING_CACHE_FOLDER, name),
+                model_utils.model_version(name),
+                model_utils.embedding_dim(name),
+                dtype=config.EMBEDDING_DTYPE
+            )
+        return _caches[name]
+
+def opened_caches():
+    with _caches_lock:
+        return dict(_caches)
+
+def flush_all():
+    for cache in opened_caches().values():
+        cache.flush()
@@ -0,0 +1,99 @@
+import os
+import time
+import argparse
+try:
+    from modelling.clothing_detection import config, model_utils
+except ImportError:
+    try:
+        from clothing_detection import config, model_utils
+    except ImportError:
+        import config
+        import model_utils
+
+
+# Подготовка бэкендов инференса (см. model_utils.build_image_encoder) и проверка их точности:
+#   export - однократный экспорт image-энкодера моделей в ONNX (и динамическая int8-квантизация графа);
+#   parity - скоры бэкендов на отложенном наборе изображений в сравнении с fp32 torch и их скорость.
+
+def export_onnx(name, int8=True):
+    """Экспортирует image-энкодер модели (с нормировкой эмбеддинга) в ONNX с динамическим размером батча."""
+    import torch
+    model, processor = model_utils.get_model(name)
+
+    class ImageEncoder(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            image_features = self.model.get_image_features(pixel_values=pixel_values)
+            return image_features / image_features.norm(dim=-1, keepdim=True)
+
+    size = processor.image_processor.crop_size.get('height', 224)
+    path = model_utils.onnx_path(name, int8=False)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.onnx.export(
+        ImageEncoder(model).eval(), (torch.randn(1, 3, size, size),), path,
+        input_names=['pixel_values'], output_names=['image_embeds'],
+        dynamic_axes={'pixel_values': {0: 'batch'}, 'image_embeds': {0: 'batch'}},
+        opset_version=17
+    )
+    print(f"{name}: экспортирован {path}")
+
+    if int8:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = model_utils.onnx_path(name, int8=True)
+        quantize_dynamic(path, int8_path, weight_type=QuantType.QInt8)
+        print(f"{name}: квантованный граф {int8_path}")
+
+def list_images(folder, limit=None):
+    images = sorted(
+        os.path.join(root, file)
+        for root, dirs, files in os.walk(folder)
+        for file in files if file.lower().endswith(('.jpg', '.jpeg', '.png'))
+    )
+    return images[:limit] if limit else images
+
+def parity_check(name, image_paths, backends):
+    """
+    Сравнивает скоры бэкендов со скорами fp32 torch на одних и тех же изображениях:
+    среднее и максимальное отклонение скора, доля совпадений решения по порогу 0.5 и изображений в секунду.
+    """
+    results = {}
+    for backend in ['torch'] + [backend for backend in backends if backend != 'torch']:
+        try:
+            model_utils.get_image_encoder(name, backend)  # Подготовка бэкенда не входит в замер скорости
+        except FileNotFoundError as e:
+            print(f"{name} [{backend}]: пропущен - {e}")
+            continue
+        started = time.monotonic()
+        results[backend] = [prob for _, prob in model_utils.classify_images_stream(name, image_paths, backend=backend)]
+        seconds = time.monotonic() - started
+
+        pairs = [(ref, prob) for ref, prob in zip(results['torch'], results[backend]) if ref is not None and prob is not None]
+        drift = [abs(ref - prob) for ref, prob in pairs]
+        agreement = sum((ref >= 0.5) == (prob >= 0.5) for ref, prob in pairs) / max(len(pairs), 1)
+        print(
+            f"{name} [{backend}]: изображений {len(pairs)}, {len(image_paths) / seconds:.1f} изобр./с, "
+            f"отклонение от fp32: среднее {sum(drift) / max(len(drift), 1):.4f}, максимальное {max(drift, default=0):.4f}, "
+            f"совпадение решений {agreement:.1%}"
+        )
+
+if __name__ == "__main__":
+    # Пример: python inference_backends.py export; python inference_backends.py parity --limit 200
+    parser = argparse.ArgumentParser(description='Экспорт моделей в ONNX и проверка точности бэкендов инференса.')
+    parser.add_argument('action', choices=['export', 'parity'])
+    parser.add_argument('--models', nargs='+', default=config.ENABLED_MODELS)
+    parser.add_argument('--no-int8', action='store_true', help='Не создавать квантованный ONNX-граф')
+    parser.add_argument('--images', default=config.PARITY_IMAGES_FOLDER, help='Отложенный набор изображений для parity')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument(
+        '--backends', nargs='+', choices=['torch_int8', 'onnx', 'onnx_int8'], default=['torch_int8', 'onnx', 'onnx_int8']
+    )
+    args = parser.parse_args()
+
+    for name in args.models:
+        if args.action == 'export':
+            export_onnx(name, int8=not args.no_int8)
+        else:
+            parity_check(name, list_images(args.images, args.limit), args.backends)
@@ -1,35 +1,376 @@
-from transformers import CLIPProcessor, CLIPModel
+import gc
+import os
+import copy
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 # from torchvision import models, transforms
 from PIL import Image
-# import torch
+try:
+    from modelling.clothing_detection import config
+except ImportError:
+    try:
+        from clothing_detection import config
+    except ImportError:
+        import config
+
+
+# Реестр моделей: модели и процессоры загружаются при первом использовании (а не при импорте модуля)
+# и разделяются в пределах процесса. Набор моделей задается в config.MODEL_REGISTRY и config.ENABLED_MODELS;
+# если суммарный размер загруженных моделей превышает MODEL_MEMORY_BUDGET_MB, выгружаются
+# давно не использовавшиеся модели.
+
+logger = logging.getLogger(__name__)
+
+_models = {}  # имя -> {'model', 'processor', 'size_mb', 'last_used'}
+_models_lock = threading.Lock()
+_configs = {}  # имя -> CLIPConfig (без весов модели)
+_processors = {}  # имя -> CLIPProcessor (для бэкендов ONNX, которым сама модель не нужна)
+_onnx_encoders = {}  # (имя, бэкенд) -> энкодер на сессии ONNX Runtime (не зависит от загруженной модели)
+
+ONNX_BACKENDS = ('onnx', 'onnx_int8')
+
+_decode_pool = None
+_decode_lock = threading.Lock()
+
+def model_size_mb(model):
+    """Размер параметров и буферов модели в мегабайтах."""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors) / 2 ** 20
+
+def unload_model(name):
+    """Выгружает модель из памяти (при следующем использовании она будет загружена заново)."""
+    with _models_lock:
+        entry = _models.pop(name, None)
+    if entry is None:
+        return
+    del entry
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+    logger.info(f"Модель {name} выгружена")
+
+def enforce_memory_budget(keep):
+    """Выгружает давно не использовавшиеся модели (кроме keep), пока суммарный размер больше бюджета."""
+    budget = config.MODEL_MEMORY_BUDGET_MB
+    if budget is None:
+        return
+    while True:
+        with _models_lock:
+            total = sum(entry['size_mb'] for entry in _models.values())
+            candidates = sorted((entry['last_used'], name) for name, entry in _models.items() if name != keep)
+        if total <= budget or not candidates:
+            return
+        unload_model(candidates[0][1])
+
+def get_model(name):
+    """Модель и процессор по имени из MODEL_REGISTRY (загружаются при первом обращении)."""
+    with _models_lock:
+        entry = _models.get(name)
+        if entry is None:
+            # Тяжелый импорт transformers - тоже только при первой загрузке модели
+            from transformers import CLIPProcessor, CLIPModel
+            checkpoint = config.MODEL_REGISTRY[name]
+            started = time.monotonic()
+            model = CLIPModel.from_pretrained(checkpoint).eval()
+            processor = CLIPProcessor.from_pretrained(checkpoint)
+            entry = {'model': model, 'processor': processor, 'size_mb': model_size_mb(model)}
+            _models[name] = entry
+            logger.info(f"Модель {name} ({checkpoint}, {entry['size_mb']:.0f} МБ) загружена за {time.monotonic() - started:.1f} с")
+        entry['last_used'] = time.monotonic()
+    enforce_memory_budget(keep=name)
+    return entry['model'], entry['processor']
+
+def model_config(name):
+    """
+    Конфигурация модели (CLIPConfig) без загрузки весов: для версии и размерности эмбеддинга
+    в родительском процессе шардированной классификации, где сама модель не нужна.
+    """
+    with _models_lock:
+        if name not in _configs:
+            from transformers import CLIPConfig
+            _configs[name] = CLIPConfig.from_pretrained(config.MODEL_REGISTRY[name])
+        return _configs[name]
+
+def get_processor(name):
+    """Процессор модели: из загруженной модели или отдельно, без загрузки весов (для бэкендов ONNX)."""
+    with _models_lock:
+        entry = _models.get(name)
+        if entry is not None:
+            return entry['processor']
+        if name not in _processors:
+            from transformers import CLIPProcessor
+            _processors[name] = CLIPProcessor.from_pretrained(config.MODEL_REGISTRY[name])
+        return _processors[name]
+
+def loaded_models():
+    with _models_lock:
+        return list(_models)
+
+def get_text_features(name, prompts):
+    """
+    Нормированные эмбеддинги набора промптов для модели name. Считаются один раз на модель
+    и набор промптов и хранятся вместе с моделью (выгружаются вместе с ней).
+    """
+    import torch
+    model, processor = get_model(name)
+    with _models_lock:
+        entry = _models.get(name, {})
+        cached = entry.get('text_features', {}).get(tuple(prompts))
+    if cached is not None:
+        return cached
+
+    with torch.inference_mode():
+        inputs = processor(text=list(prompts), return_tensors="pt", padding=True).to(model.device)
+        text_features = model.get_text_features(**inputs)
+        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+    with _models_lock:
+        entry.setdefault('text_features', {})[tuple(prompts)] = text_features
+    return text_features
+
+def get_decode_pool():
+    """Пул потоков декодирования и предобработки изображений (декодирование JPEG в PIL отпускает GIL)."""
+    global _decode_pool
+    with _decode_lock:
+        if _decode_pool is None:
+            _decode_pool = ThreadPoolExecutor(max_workers=config.DECODE_WORKERS)
+        return _decode_pool
+
+def load_image(image_path, size):
+    """
+    Открывает изображение в RGB. JPEG декодируется сразу в уменьшенном масштабе (draft: 1/2, 1/4, 1/8),
+    но не меньше size по каждой стороне - CLIP все равно уменьшает изображение до 224px.
+    Для поврежденных и обрезанных файлов возвращает None.
+    """
+    try:
+        image = Image.open(image_path)
+        image.draft('RGB', (size, size))
+        return image.convert('RGB')
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning(f"Не удалось прочитать изображение {image_path}: {e}")
+        return None
+
+def preprocess_image(processor, image_path, size):
+    """Готовый тензор pixel_values изображения для модели или None, если файл поврежден."""
+    image = load_image(image_path, size)
+    if image is None:
+        return None
+    return processor.image_processor(images=image, return_tensors="pt")["pixel_values"][0]
+
+def model_version(name):
+    """Версия модели для инвалидации кэшей: чекпоинт, ревизия загруженных весов и бэкенд инференса."""
+    commit = getattr(model_config(name), '_commit_hash', None)
+    return f"{config.MODEL_REGISTRY[name]}@{commit}/{backend_id(name)}"
+
+def embedding_dim(name):
+    return model_config(name).projection_dim
+
+def embed_pixel_values(model, pixel_values):
+    """Нормированные эмбеддинги батча предобработанных изображений (get_image_features по всему батчу)."""
+    import torch
+    with torch.inference_mode():
+        image_features = model.get_image_features(pixel_values=torch.stack(pixel_values).to(model.device))
+        return image_features / image_features.norm(dim=-1, keepdim=True)
+
+def onnx_path(name, int8=None):
+    """Путь к экспортированному ONNX-графу image-энкодера модели (int8 - динамически квантованная версия)."""
+    int8 = config.ONNX_INT8 if int8 is None else int8
+    return os.path.join(config.ONNX_FOLDER, f"{name}{'_int8' if int8 else ''}.onnx")
+
+def default_backend():
+    """Бэкенд из config: "onnx" при ONNX_INT8 = True - это "onnx_int8"."""
+    if config.INFERENCE_BACKEND == 'onnx' and config.ONNX_INT8:
+        return 'onnx_int8'
+    return config.INFERENCE_BACKEND
+
+def backend_id(name, backend=None):
+    """
+    Бэкенд для версий кэшей: для ONNX - с путем к графу (fp32 и int8 графы дают разные эмбеддинги),
+    его mtime и размером (повторный экспорт в тот же путь, например после смены чекпоинта, сбрасывает кэши).
+    """
+    backend = backend or default_backend()
+    if backend in ONNX_BACKENDS:
+        path = onnx_path(name, int8=backend == 'onnx_int8')
+        if not os.path.exists(path):
+            return f"{backend}:{path}"
+        stat = os.stat(path)
+        return f"{backend}:{path}@{stat.st_mtime_ns}-{stat.st_size}"
+    return backend
+
+def build_image_encoder(name, backend):
+    """
+    Функция pixel_values -> нормированные эмбеддинги для бэкенда инференса:
+    'torch' - модель в fp32, 'torch_int8' - копия модели с динамически квантованными в int8 Linear-слоями,
+    'onnx' и 'onnx_int8' - экспортированный граф fp32 или int8 (см. inference_backends.py) в ONNX Runtime на CPU
+    (веса torch-модели для них не загружаются).
+    """
+    import torch
+    if backend in ONNX_BACKENDS:
+        import onnxruntime
+        path = onnx_path(name, int8=backend == 'onnx_int8')
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Нет ONNX-графа {path}: выполните python inference_backends.py export")
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        return lambda pixel_values: torch.from_numpy(
+            session.run(None, {'pixel_values': torch.stack(pixel_values).numpy()})[0]
+        )
+    model, _ = get_model(name)
+    if backend == 'torch':
+        return lambda pixel_values: embed_pixel_values(model, pixel_values)
+    if backend == 'torch_int8':
+        quantized = torch.quantization.quantize_dynamic(copy.deepcopy(model), {torch.nn.Linear}, dtype=torch.qint8)
+        return lambda pixel_values: embed_pixel_values(quantized, pixel_values)
+    raise ValueError(f"Неизвестный бэкенд инференса: {backend}")
+
+def get_image_encoder(name, backend=None):
+    """
+    Image-энкодер модели для бэкенда (по умолчанию default_backend()), создается один раз и хранится вместе
+    с моделью, а для бэкендов ONNX - отдельно от нее.
+    """
+    backend = backend or default_backend()
+    if backend in ONNX_BACKENDS:
+        with _models_lock:
+            encoder = _onnx_encoders.get((name, backend))
+        if encoder is None:
+            encoder = build_image_encoder(name, backend)
+            with _models_lock:
+                _onnx_encoders[(name, backend)] = encoder
+            logger.info(f"Бэкенд инференса {backend} для модели {name} готов")
+        return encoder
+    get_model(name)
+    with _models_lock:
+        entry = _models.get(name, {})
+        encoder = entry.get('encoders', {}).get(backend)
+    if encoder is None:
+        encoder = build_image_encoder(name, backend)
+        with _models_lock:
+            entry.setdefault('encoders', {})[backend] = encoder
+        logger.info(f"Бэкенд инференса {backend} для модели {name} готов")
+    return encoder
+
+def text_head(name, prompts):
+    """
+    Все, что нужно для скоров по готовым эмбеддингам изображений: нормированные эмбеддинги промптов
+    (numpy) и масштаб логитов модели. Результат можно передать из процесса-воркера в родительский процесс.
+    С бэкендом ONNX torch-модель нужна только для этого и после расчета выгружается.
+    """
+    was_loaded = name in loaded_models()
+    model, _ = get_model(name)
+    text_features = get_text_features(name, prompts)
+    head = text_features.float().cpu().numpy(), float(model.logit_scale.exp())
+    if not was_loaded and default_backend() in ONNX_BACKENDS:
+        del model, text_features
+        unload_model(name)
+    return head
+
+def softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+def score_embeddings(name, image_features, prompts=None, head=None):
+    """
+    Вероятности наличия одежды (нулевого промпта) по нормированным эмбеддингам изображений
+    (массив numpy, например строки кэша эмбеддингов) - одно матричное умножение.
+    head - готовый результат text_head (тогда модель в этом процессе не загружается).
+    """
+    text_features, logit_scale = head or text_head(name, prompts or config.PROMPTS)
+    probs = softmax(logit_scale * np.asarray(image_features, dtype=np.float32) @ text_features.T)
+    return probs[:, 0].tolist()
+
+def preprocessed_batches(name, image_paths, batch_size=None):
+    """
+    Батчи по batch_size пар (путь, pixel_values или None для поврежденного файла).
+    Пока модель обрабатывает батч, пул потоков уже декодирует и предобрабатывает следующие
+    (не больше PREFETCH_BATCHES батчей вперед).
+    """
+    batch_size = batch_size or config.BATCH_SIZE
+    processor = get_processor(name)
+    size = processor.image_processor.size.get('shortest_edge', 224)
+    pool = get_decode_pool()
+
+    paths = iter(image_paths)
+    pending = deque()
+
+    def prefetch():
+        while len(pending) < batch_size * (config.PREFETCH_BATCHES + 1):
+            image_path = next(paths, None)
+            if image_path is None:
+                return
+            pending.append((image_path, pool.submit(preprocess_image, processor, image_path, size)))
+
+    prefetch()
+    while pending:
+        batch = [pending.popleft() for _ in range(min(batch_size, len(pending)))]
+        prefetch()
+        yield [(image_path, future.result()) for image_path, future in batch]
+
+def embed_images_stream(name, image_paths, batch_size=None, backend=None):
+    """Пары (путь, нормированный эмбеддинг float32 в numpy или None для поврежденного файла)."""
+    encode = get_image_encoder(name, backend)
+    for batch in preprocessed_batches(name, image_paths, batch_size):
+        pixel_values = [tensor for _, tensor in batch if tensor is not None]
+        embeddings = iter(encode(pixel_values).float().cpu().numpy() if pixel_values else [])
+        for image_path, tensor in batch:
+            yield image_path, next(embeddings) if tensor is not None else None
+
+def init_worker(torch_threads):
+    """
+    Инициализация процесса-воркера шардированной классификации: число потоков torch ограничивается,
+    чтобы воркеры не конкурировали за одни и те же ядра.
+    """
+    import torch
+    torch.set_num_threads(torch_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Уже задано в этом процессе
+
+def embed_shard(name, image_paths):
+    """Эмбеддинги части изображений в процессе-воркере (модель загружается один раз на процесс)."""
+    return list(embed_images_stream(name, image_paths))
+
+def classify_images_stream(name, image_paths, batch_size=None, prompts=None, backend=None):
+    """
+    Классифицирует изображения моделью name батчами по batch_size и выдает пары (путь, вероятность).
+    Для поврежденных файлов вероятность - None.
+    """
+    encode = get_image_encoder(name, backend)
+    head = text_head(name, prompts or config.PROMPTS)  # Один раз на поток, а не на каждый батч
+    for batch in preprocessed_batches(name, image_paths, batch_size):
+        pixel_values = [tensor for _, tensor in batch if tensor is not None]
+        probs = iter(score_embeddings(name, encode(pixel_values).float().cpu().numpy(), head=head) if pixel_values else [])
+        for image_path, tensor in batch:
+            yield image_path, next(probs) if tensor is not None else None
+
+def classify_images_batch(name, image_paths, prompts=None):
+    """Вероятности наличия одежды для списка изображений по модели name (None для поврежденных файлов)."""
+    return [prob for _, prob in classify_images_stream(name, image_paths, prompts=prompts)]
+
+def classify_image(name, image_path):
+    """Вероятность наличия одежды на изображении по модели name."""
+    return classify_images_batch(name, [image_path])[0]
 
 # ============================
 # CLIP Model (Open AI) - Базовая версия
 # ============================
-clip_base_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-clip_base_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-
 def classify_image_clip_base(image_path):
-    image = Image.open(image_path)
-    inputs = clip_base_processor(text=['Is clothes', 'Is not clothes'], images=image, return_tensors="pt", padding=True)
-    outputs = clip_base_model(**inputs)
-    logits_per_image = outputs.logits_per_image
-    probs = logits_per_image.softmax(dim=1)
-    return probs[0][0].item()  # Вероятность наличия одежды (нулевого класса в списке text)
+    return classify_image('CLIP_base', image_path)
 
 # ============================
 # CLIP Model (Open AI) - Большая версия
 # ============================
-clip_large_model = CLIPModel.from_pretrained("openai/clip-vit-large-patch14")
-clip_large_processor = CLIPProcessor.from_pretrained("openai/clip-vit-large-patch14")
-
 def classify_image_clip_large(image_path):
-    image = Image.open(image_path)
-    inputs = clip_large_processor(text=['Is clothes', 'Is not clothes'], images=image, return_tensors="pt", padding=True)
-    outputs = clip_large_model(**inputs)
-    logits_per_image = outputs.logits_per_image
-    probs = logits_per_image.softmax(dim=1)
-    return probs[0][0].item()  # Вероятность наличия одежды (нулевого класса в списке text)
+    return classify_image('CLIP_large', image_path)
 
 # # ============================
 # # ResNet50 Model - Pretrained on ImageNet
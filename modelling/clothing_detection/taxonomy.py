@@ -0,0 +1,107 @@
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+try:
+    from modelling.clothing_detection import config, model_utils
+except ImportError:
+    try:
+        from clothing_detection import config, model_utils
+    except ImportError:
+        import config
+        import model_utils
+
+
+# Многометочная zero-shot классификация по таксономии TAXONOMY_FILE: группы меток (тип одежды, цвет,
+# стиль...), каждая метка подставляется в шаблон промпта группы (или общий "template").
+# Эмбеддинги всех промптов считаются один раз на модель (model_utils.get_text_features), изображение
+# сравнивается со всеми метками всех групп одним матричным умножением, softmax считается внутри
+# каждой группы. Поэтому сотня дополнительных меток почти не увеличивает время на изображение.
+
+_taxonomy = None
+
+def load_taxonomy():
+    """Таксономия из TAXONOMY_FILE: {группа: [промпты меток]} и {группа: [метки]} (загружается один раз)."""
+    global _taxonomy
+    if _taxonomy is None:
+        with open(config.TAXONOMY_FILE, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+        default_template = raw.get('template', '{}')
+        labels, prompts = {}, {}
+        for group, spec in raw['groups'].items():
+            # Группа - список меток или {"template": ..., "labels": [...]}
+            if isinstance(spec, dict):
+                template, group_labels = spec.get('template', default_template), spec['labels']
+            else:
+                template, group_labels = default_template, spec
+            labels[group] = list(group_labels)
+            prompts[group] = [template.format(label) for label in group_labels]
+        # Версия (промпты, модель, TAXONOMY_TOP_K): при ее смене метки изображений считаются заново
+        settings = {
+            'prompts': prompts,
+            'model': config.MODEL_REGISTRY[config.TAXONOMY_MODEL],
+            'top_k': config.TAXONOMY_TOP_K
+        }
+        version = hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        _taxonomy = {'labels': labels, 'prompts': prompts, 'version': version}
+    return _taxonomy
+
+def taxonomy_version():
+    return load_taxonomy()['version']
+
+def taxonomy_prompts():
+    """Промпты всех меток всех групп подряд (в порядке групп)."""
+    taxonomy = load_taxonomy()
+    return [prompt for group in taxonomy['prompts'] for prompt in taxonomy['prompts'][group]]
+
+def score_taxonomy(image_features, top_k=None, head=None):
+    """
+    Метки таксономии по нормированным эмбеддингам изображений TAXONOMY_MODEL (массив numpy):
+    для каждого изображения {группа: [[метка, вероятность], ...]} - top_k меток группы по убыванию вероятности.
+    head - готовый результат model_utils.text_head для taxonomy_prompts() (тогда модель не загружается).
+    """
+    top_k = top_k or config.TAXONOMY_TOP_K
+    taxonomy = load_taxonomy()
+    text_features, logit_scale = head or model_utils.text_head(config.TAXONOMY_MODEL, taxonomy_prompts())
+
+    # Одно умножение на все метки всех групп, дальше - softmax по столбцам каждой группы
+    logits = logit_scale * np.asarray(image_features, dtype=np.float32) @ text_features.T
+    results = [{} for _ in range(len(logits))]
+    start = 0
+    for group, labels in taxonomy['labels'].items():
+        probs = model_utils.softmax(logits[:, start:start + len(labels)])
+        top = np.argsort(-probs, axis=1)[:, :top_k]
+        for result, group_probs, group_top in zip(results, probs, top):
+            result[group] = [[labels[j], float(group_probs[j])] for j in group_top]
+        start += len(labels)
+    return results
+
+def classify_taxonomy(image_paths):
+    """Метки таксономии для списка изображений (None для поврежденного файла)."""
+    paths, embeddings = [], []
+    for image_path, embedding in model_utils.embed_images_stream(config.TAXONOMY_MODEL, image_paths):
+        if embedding is not None:
+            paths.append(image_path)
+            embeddings.append(embedding)
+    results = dict(zip(paths, score_taxonomy(np.stack(embeddings)))) if embeddings else {}
+    return [results.get(image_path) for image_path in image_paths]
+
+if __name__ == "__main__":
+    # Пример: python taxonomy.py photo.jpg - проверка меток таксономии на отдельных изображениях
+    parser = argparse.ArgumentParser(description='Метки таксономии TAXONOMY_FILE для изображений.')
+    parser.add_argument('images', nargs='+')
+    parser.add_argument(
+        '--taxonomy', default=config.TAXONOMY_FILE or os.path.join(os.path.dirname(__file__), 'taxonomy.json'),
+        help='Файл таксономии (по умолчанию TAXONOMY_FILE или taxonomy.json рядом со скриптом)'
+    )
+    args = parser.parse_args()
+    config.TAXONOMY_FILE = args.taxonomy
+
+    for image_path, result in zip(args.images, classify_taxonomy(args.images)):
+        print(os.path.basename(image_path))
+        if result is None:
+            print('  файл поврежден')
+            continue
+        for group, labels in result.items():
+            print(f"  {group}: " + ", ".join(f"{label} ({prob:.2f})" for label, prob in labels))
@@ -0,0 +1,43 @@
+# similarity_config.py
+
+# Путь к лог-файлу поиска похожих изображений
+LOG_FILE_SIMILARITY = "modelling/similarity_search/similarity_search.log"
+
+# Уровень логирования (может быть INFO, DEBUG, WARNING и т.д.)
+LOGGING_LEVEL = "INFO"
+
+# Модель эмбеддингов (имя из MODEL_REGISTRY в modelling/clothing_detection/config.py). Эмбеддинги берутся
+# из кэша эмбеддингов классификатора, изображения без эмбеддинга досчитываются при построении индекса
+INDEX_MODEL = "CLIP_base"
+
+# Папка индекса
+INDEX_FOLDER = "modelling/similarity_search/index"
+
+# Хранение векторов в индексе: "float16" (точные скоры, 2 байта на координату) или "pq" - product quantization
+# (PQ_SUBVECTORS байт на изображение, скоры приближенные; размерность эмбеддинга должна делиться на PQ_SUBVECTORS)
+INDEX_STORAGE = "float16"
+PQ_SUBVECTORS = 64
+
+# Приближенный поиск IVF: векторы разбиваются на IVF_LISTS кластеров (None - только точный перебор),
+# запрос просматривает IVF_PROBES ближайших кластеров
+IVF_LISTS = 1024
+IVF_PROBES = 16
+
+# Сколько векторов используется для обучения кластеров IVF и кодбуков PQ
+TRAIN_SAMPLE = 50000
+
+# Точный поиск перебирает индекс блоками по SEARCH_BLOCK_SIZE векторов (ограничивает память на батч запросов)
+SEARCH_BLOCK_SIZE = 65536
+
+# Сколько похожих изображений возвращает запрос
+TOP_K = 50
+
+# Досчитывать эмбеддинги изображений хранилища медиа, которых нет в кэше классификатора (в собственный кэш индекса)
+EMBED_MISSING_MEDIA = True
+
+# Интервал (в секундах) добавления новых изображений в индекс в режиме наблюдения (sync --watch)
+SYNC_INTERVAL = 300
+
+# Бенчмарк: число случайных запросов из корпуса и проверяемые значения IVF_PROBES
+BENCHMARK_QUERIES = 200
+BENCHMARK_PROBES = [1, 4, 16, 64]
@@ -0,0 +1,247 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import numpy as np
+from config import (
+    LOG_FILE_SIMILARITY, LOGGING_LEVEL, INDEX_MODEL, INDEX_FOLDER, INDEX_STORAGE, PQ_SUBVECTORS, IVF_LISTS,
+    IVF_PROBES, TRAIN_SAMPLE, SEARCH_BLOCK_SIZE, TOP_K, EMBED_MISSING_MEDIA, SYNC_INTERVAL, BENCHMARK_QUERIES,
+    BENCHMARK_PROBES
+)
+# Корень репозитория - для импорта классификатора (кэш эмбеддингов, модели) и общих модулей parsing/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from modelling.clothing_detection import config as detection_config, model_utils, embedding_cache
+from parsing import media_store
+try:
+    from modelling.similarity_search.vector_index import VectorIndex, normalize, search_blocks
+except ImportError:
+    from vector_index import VectorIndex, normalize, search_blocks
+
+
+# Поиск похожих изображений по всему корпусу распарсенных медиа. Индекс (vector_index.py) строится
+# по кэшу эмбеддингов классификатора для модели INDEX_MODEL (только чтение), поэтому изображения, уже
+# прошедшие классификацию, повторно через модель не прогоняются. Эмбеддинги остальных изображений
+# хранилища медиа считаются в собственный кэш индекса (<INDEX_FOLDER>/embeddings). Команды:
+#   build - построение индекса заново (обучение кластеров IVF и кодбуков PQ);
+#   sync - добавление новых изображений (с --watch - каждые SYNC_INTERVAL секунд);
+#   query - похожие изображения для файлов; benchmark - полнота и задержка поиска.
+
+logging.basicConfig(
+    filename=LOG_FILE_SIMILARITY,
+    level=getattr(logging, LOGGING_LEVEL),
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+logger = logging.getLogger(__name__)
+
+def media_paths():
+    """Пути изображений по хэшу содержимого: файлы хранилища медиа и файлы, уже хэшированные классификатором."""
+    paths = {}
+    digests_file = os.path.join(detection_config.EMBEDDING_CACHE_FOLDER, 'paths.json')
+    if os.path.exists(digests_file):
+        with open(digests_file, 'r', encoding='utf-8') as f:
+            for path, (_, digest) in json.load(f).items():
+                paths[digest] = path
+    for root, dirs, files in os.walk(detection_config.MEDIA_STORE_FOLDER):
+        for file in files:
+            digest = media_store.digest_from_path(file)
+            if digest:
+                paths[digest] = os.path.join(root, file)
+    return paths
+
+def classifier_embeddings():
+    """
+    Снимок кэша эмбеддингов классификатора только для чтения: в кэш пишет классификатор (в том числе
+    параллельно, в режиме наблюдения), индекс его не изменяет. Снимок открывается заново при каждом sync.
+    """
+    for attempt in range(3):
+        try:
+            return embedding_cache.EmbeddingCache(
+                os.path.join(detection_config.EMBEDDING_CACHE_FOLDER, INDEX_MODEL),
+                model_utils.model_version(INDEX_MODEL), model_utils.embedding_dim(INDEX_MODEL),
+                dtype=detection_config.EMBEDDING_DTYPE, read_only=True
+            )
+        except FileNotFoundError:
+            # Классификатор как раз переключился на уплотненный файл эмбеддингов - читаем index.json заново
+            time.sleep(1)
+    raise RuntimeError("Не удалось открыть кэш эмбеддингов классификатора")
+
+def own_embeddings():
+    """Собственный кэш индекса: эмбеддинги изображений, которых нет в кэше классификатора."""
+    return embedding_cache.EmbeddingCache(
+        os.path.join(INDEX_FOLDER, 'embeddings'), model_utils.model_version(INDEX_MODEL),
+        model_utils.embedding_dim(INDEX_MODEL), dtype=detection_config.EMBEDDING_DTYPE
+    )
+
+def embed_missing_media(classifier, own):
+    """Считает эмбеддинги изображений хранилища медиа, которых нет ни в одном из кэшей (в собственный кэш)."""
+    missing = [(digest, path) for digest, path in media_paths().items() if digest not in classifier and digest not in own]
+    for (digest, _), (_, embedding) in zip(missing, model_utils.embed_images_stream(INDEX_MODEL, [path for _, path in missing])):
+        if embedding is not None:
+            own.add(digest, embedding)
+    own.flush()
+    if missing:
+        logger.info(f"Рассчитано эмбеддингов для изображений без кэша: {len(missing)}")
+
+def corpus_sources():
+    """Источники эмбеддингов корпуса: снимок кэша классификатора и собственный кэш индекса."""
+    classifier, own = classifier_embeddings(), own_embeddings()
+    if EMBED_MISSING_MEDIA:
+        embed_missing_media(classifier, own)
+    return classifier, own
+
+def corpus_items(sources):
+    """Эмбеддинги корпуса порциями (хэши, матрица); изображение, которое есть в обоих кэшах, выдается один раз."""
+    classifier, own = sources
+    yield from classifier.items(SEARCH_BLOCK_SIZE)
+    for digests, embeddings in own.items(SEARCH_BLOCK_SIZE):
+        rows = [row for row, digest in enumerate(digests) if digest not in classifier]
+        if rows:
+            yield [digests[row] for row in rows], embeddings[rows]
+
+def corpus_vectors(sources, digests):
+    """Эмбеддинги изображений корпуса по хэшам (в порядке digests)."""
+    classifier, own = sources
+    vectors = {}
+    for cache in (own, classifier):
+        found = [digest for digest in digests if digest in cache]
+        vectors.update(zip(found, cache.get_many(found)) if found else [])
+    return np.stack([vectors[digest] for digest in digests])
+
+def add_from_cache(index, sources):
+    """Добавляет в индекс эмбеддинги корпуса, которых в нем еще нет."""
+    added = 0
+    for digests, embeddings in corpus_items(sources):
+        new = [row for row, digest in enumerate(digests) if digest not in index]
+        if new:
+            added += index.add([digests[row] for row in new], embeddings[new])
+    return added
+
+def build_index():
+    """Строит индекс заново: обучение на случайной выборке TRAIN_SAMPLE эмбеддингов и добавление всего корпуса."""
+    sources = corpus_sources()
+    digests = [digest for chunk, _ in corpus_items(sources) for digest in chunk]
+    if not digests:
+        print("Кэш эмбеддингов пуст - нечего индексировать")
+        return None
+
+    index = VectorIndex(INDEX_FOLDER)
+    index.create(
+        model_utils.model_version(INDEX_MODEL), model_utils.embedding_dim(INDEX_MODEL),
+        storage=INDEX_STORAGE, pq_subvectors=PQ_SUBVECTORS, ivf_lists=IVF_LISTS
+    )
+    sample = np.random.default_rng(0).choice(len(digests), min(TRAIN_SAMPLE, len(digests)), replace=False)
+    started = time.monotonic()
+    index.train(corpus_vectors(sources, [digests[row] for row in sample]))
+    added = add_from_cache(index, sources)
+    index.meta['trained_corpus'] = len(index)
+    index.flush()
+
+    report = f"Индекс {INDEX_FOLDER} ({INDEX_STORAGE}) построен: {added} изображений за {time.monotonic() - started:.1f} с"
+    logger.info(report)
+    print(report)
+    return index
+
+def sync_index():
+    """
+    Добавляет в индекс новые изображения (без переобучения). Если индекса нет или модель изменилась -
+    индекс строится заново.
+    """
+    index = VectorIndex(INDEX_FOLDER)
+    if index.meta is None or not index.trained or index.meta['version'] != model_utils.model_version(INDEX_MODEL):
+        return build_index()
+
+    added = add_from_cache(index, corpus_sources())
+    logger.info(f"В индекс добавлено изображений: {added}, всего: {len(index)}")
+    print(f"В индекс добавлено изображений: {added}, всего: {len(index)}")
+    # Кластеры и кодбуки обучены на старой части корпуса - при сильном росте их стоит переобучить
+    if len(index) > 4 * index.meta.get('trained_corpus', len(index)):
+        logger.warning("Индекс вырос в 4+ раза с момента обучения, рекомендуется перестроить его: python search_index.py build")
+    return index
+
+def search(index, queries, k=TOP_K, nprobe=IVF_PROBES, exact=False):
+    """Батч запросов (эмбеддинги Q x d) -> для каждого список (хэш, путь к изображению, скор)."""
+    paths = media_paths()
+    results = index.search(queries, k=k, nprobe=nprobe, exact=exact, block_size=SEARCH_BLOCK_SIZE)
+    return [[(digest, paths.get(digest), score) for digest, score in result] for result in results]
+
+def query_images(image_paths, k=TOP_K, nprobe=IVF_PROBES, exact=False):
+    """Похожие изображения для списка файлов (None для поврежденного файла)."""
+    index = VectorIndex(INDEX_FOLDER)
+    embedded = [(path, embedding) for path, embedding in model_utils.embed_images_stream(INDEX_MODEL, image_paths) if embedding is not None]
+    results = dict(zip(
+        [path for path, _ in embedded],
+        search(index, np.stack([embedding for _, embedding in embedded]), k, nprobe, exact) if embedded else []
+    ))
+    return [results.get(path) for path in image_paths]
+
+def benchmark(queries_count=BENCHMARK_QUERIES, k=TOP_K):
+    """
+    Полнота (recall@k) и задержка поиска на случайных изображениях корпуса. Эталон - точный поиск
+    по эмбеддингам кэшей в float32; проверяются точный перебор индекса и IVF с разным числом кластеров.
+    """
+    index = VectorIndex(INDEX_FOLDER)
+    sources = classifier_embeddings(), own_embeddings()
+    digests = [digest for chunk, _ in corpus_items(sources) for digest in chunk if digest in index]
+    if not digests:
+        print("Индекс пуст - сначала выполните python search_index.py build")
+        return
+    rng = np.random.default_rng(0)
+    queries = normalize(corpus_vectors(sources, [digests[row] for row in rng.choice(len(digests), min(queries_count, len(digests)), replace=False)]))
+
+    cache_digests = []
+    def cache_blocks():
+        for chunk, embeddings in corpus_items(sources):
+            rows = np.arange(len(cache_digests), len(cache_digests) + len(chunk))
+            cache_digests.extend(chunk)
+            yield rows, queries @ normalize(embeddings).T
+    _, truth_rows = search_blocks(len(queries), cache_blocks(), k)
+    truth = [{cache_digests[row] for row in rows if row >= 0} for rows in truth_rows]
+
+    modes = [('точный перебор', {'exact': True})]
+    if index.centroids is not None:
+        index.inverted_lists()  # Построение обратных списков не входит в замер задержки
+        modes += [(f'IVF, кластеров {nprobe}', {'nprobe': nprobe}) for nprobe in BENCHMARK_PROBES]
+    print(f"Индекс: {len(index)} изображений ({index.meta['storage']}), запросов: {len(queries)}, k={k}")
+    for title, params in modes:
+        started = time.monotonic()
+        results = index.search(queries, k=k, block_size=SEARCH_BLOCK_SIZE, **params)
+        seconds = time.monotonic() - started
+        recall = np.mean([
+            len(expected & {digest for digest, _ in result}) / max(len(expected), 1)
+            for expected, result in zip(truth, results)
+        ])
+        report = f"{title}: recall@{k} {recall:.3f}, {seconds / len(queries) * 1000:.2f} мс/запрос, {len(queries) / seconds:.0f} запросов/с"
+        logger.info(report)
+        print(report)
+
+if __name__ == "__main__":
+    # Пример: python search_index.py build; python search_index.py query look.jpg --k 50
+    parser = argparse.ArgumentParser(description='Индекс поиска похожих изображений по распарсенным медиа.')
+    parser.add_argument('action', choices=['build', 'sync', 'query', 'benchmark'])
+    parser.add_argument('images', nargs='*', help='Изображения для query')
+    parser.add_argument('--k', type=int, default=TOP_K)
+    parser.add_argument('--nprobe', type=int, default=IVF_PROBES)
+    parser.add_argument('--exact', action='store_true', help='Точный перебор вместо IVF')
+    parser.add_argument('--watch', action='store_true', help='sync каждые SYNC_INTERVAL секунд')
+    args = parser.parse_args()
+
+    if args.action == 'build':
+        build_index()
+    elif args.action == 'sync':
+        sync_index()
+        while args.watch:
+            time.sleep(SYNC_INTERVAL)
+            sync_index()
+    elif args.action == 'query':
+        for image_path, result in zip(args.images, query_images(args.images, args.k, args.nprobe, args.exact)):
+            print(image_path)
+            if result is None:
+                print('  файл поврежден')
+                continue
+            for digest, path, score in result:
+                print(f"  {score:.3f}  {path or digest}")
+    else:
+        benchmark(k=args.k)
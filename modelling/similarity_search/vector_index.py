@@ -0,0 +1,275 @@
+import os
+import json
+import logging
+import numpy as np
+
+
+# Индекс нормированных эмбеддингов изображений для поиска похожих (скор - косинусная близость).
+# Векторы хранятся в float16 или сжатыми product quantization (PQ: вектор делится на m подвекторов,
+# каждый заменяется номером ближайшего из 256 центроидов - 1 байт), поиск - точный перебор блоками
+# или IVF (векторы разбиты на кластеры, запрос просматривает только ближайшие кластеры).
+# Файлы векторов, кодов и номеров кластеров только дописываются, поэтому новые изображения
+# добавляются в индекс без его перестроения.
+
+logger = logging.getLogger(__name__)
+
+def normalize(vectors):
+    """Векторы float32 единичной длины."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def merge_top_k(best_scores, best_rows, scores, rows, k):
+    """Объединяет текущие top-k (Q x k) со скорами нового блока (Q x n) для строк rows (n или Q x n)."""
+    scores = np.concatenate([best_scores, scores], axis=1)
+    rows = np.concatenate([best_rows, np.broadcast_to(rows, scores[:, best_scores.shape[1]:].shape)], axis=1)
+    if scores.shape[1] > k:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, top, axis=1)
+        rows = np.take_along_axis(rows, top, axis=1)
+    return scores, rows
+
+def search_blocks(queries_count, blocks, k):
+    """
+    Точный top-k по блокам: blocks - итератор пар (номера строк, скоры запросов по этим строкам Q x n).
+    Возвращает (скоры, номера строк) размером Q x k по убыванию скора (-inf и -1, если строк меньше k).
+    """
+    best_scores = np.empty((queries_count, 0), dtype=np.float32)
+    best_rows = np.empty((queries_count, 0), dtype=np.int64)
+    for rows, scores in blocks:
+        best_scores, best_rows = merge_top_k(best_scores, best_rows, scores, rows, k)
+    return sort_top_k(best_scores, best_rows, k)
+
+def sort_top_k(scores, rows, k):
+    """Сортирует найденные строки по убыванию скора и дополняет результат до k столбцов."""
+    order = np.argsort(-scores, axis=1)
+    scores = np.take_along_axis(scores, order, axis=1)
+    rows = np.take_along_axis(rows, order, axis=1)
+    missing = k - scores.shape[1]
+    if missing > 0:
+        scores = np.pad(scores, ((0, 0), (0, missing)), constant_values=-np.inf)
+        rows = np.pad(rows, ((0, 0), (0, missing)), constant_values=-1)
+    return scores, rows
+
+def nearest_centroids(vectors, centroids, n=1, block_size=65536):
+    """Номера n ближайших (по евклидову расстоянию) центроидов для каждого вектора: массив N или N x n."""
+    half_norms = (centroids ** 2).sum(axis=1) / 2
+    result = []
+    for start in range(0, len(vectors), block_size):
+        scores = np.asarray(vectors[start:start + block_size], dtype=np.float32) @ centroids.T - half_norms
+        if n == 1:
+            result.append(scores.argmax(axis=1))
+        else:
+            result.append(np.argpartition(-scores, n - 1, axis=1)[:, :n])
+    return np.concatenate(result)
+
+def kmeans(vectors, k, iterations=20, seed=0):
+    """Центроиды k-means (не больше числа векторов); пустые кластеры переинициализируются случайными векторами."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = nearest_centroids(vectors, centroids)
+        counts = np.bincount(assignments, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+    return centroids
+
+class VectorIndex:
+    """
+    Индекс в папке folder: meta.json (параметры и хэши изображений по строкам), vectors.bin (float16)
+    или codes.bin (коды PQ), lists.bin (номер кластера IVF строки), обученные centroids.npy и codebooks.npy.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.meta_file = os.path.join(folder, 'meta.json')
+        self.meta = None
+        self.centroids = None
+        self.codebooks = None
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+            if os.path.exists(self.file('centroids.npy')):
+                self.centroids = np.load(self.file('centroids.npy'))
+            if os.path.exists(self.file('codebooks.npy')):
+                self.codebooks = np.load(self.file('codebooks.npy'))
+        self.rows = {digest: row for row, digest in enumerate(self.meta['digests'])} if self.meta else {}
+        self._data = None
+        self._lists = None
+
+    def file(self, name):
+        return os.path.join(self.folder, name)
+
+    def create(self, version, dim, storage='float16', pq_subvectors=64, ivf_lists=None):
+        """Создает пустой необученный индекс (существующий индекс в папке удаляется)."""
+        if storage not in ('float16', 'pq'):
+            raise ValueError(f"Неизвестный формат хранения векторов: {storage}")
+        if storage == 'pq' and dim % pq_subvectors:
+            raise ValueError(f"Размерность {dim} не делится на число подвекторов PQ {pq_subvectors}")
+        os.makedirs(self.folder, exist_ok=True)
+        for name in ('vectors.bin', 'codes.bin', 'lists.bin', 'centroids.npy', 'codebooks.npy'):
+            if os.path.exists(self.file(name)):
+                os.remove(self.file(name))
+        self.meta = {
+            'version': version, 'dim': dim, 'storage': storage, 'pq_subvectors': pq_subvectors,
+            'ivf_lists': ivf_lists, 'trained_on': 0, 'digests': []
+        }
+        self.centroids = self.codebooks = None
+        self.rows = {}
+        self._data = self._lists = None
+        self.flush()
+
+    def __len__(self):
+        return len(self.meta['digests']) if self.meta else 0
+
+    def __contains__(self, digest):
+        return digest in self.rows
+
+    @property
+    def trained(self):
+        return (
+            (not self.meta['ivf_lists'] or self.centroids is not None) and
+            (self.meta['storage'] != 'pq' or self.codebooks is not None)
+        )
+
+    def train(self, sample):
+        """
+        Обучает кластеры IVF и кодбуки PQ на выборке векторов. Кластеров не больше, чем по 39 векторов
+        выборки на кластер (меньшие кластеры обучаются неустойчиво).
+        """
+        sample = normalize(sample)
+        if self.meta['ivf_lists']:
+            lists = max(1, min(self.meta['ivf_lists'], len(sample) // 39))
+            self.centroids = kmeans(sample, lists)
+            np.save(self.file('centroids.npy'), self.centroids)
+        if self.meta['storage'] == 'pq':
+            m = self.meta['pq_subvectors']
+            subvectors = sample.reshape(len(sample), m, -1)
+            self.codebooks = np.stack([kmeans(np.ascontiguousarray(subvectors[:, j]), 256, seed=j) for j in range(m)])
+            np.save(self.file('codebooks.npy'), self.codebooks)
+        self.meta['trained_on'] = len(sample)
+        self.flush()
+        logger.info(f"Индекс {self.folder} обучен на {len(sample)} векторах")
+
+    def encode(self, vectors):
+        """Коды PQ (N x m, uint8): номер ближайшего центроида для каждого подвектора."""
+        m = self.meta['pq_subvectors']
+        subvectors = vectors.reshape(len(vectors), m, -1)
+        return np.stack([nearest_centroids(subvectors[:, j], self.codebooks[j]) for j in range(m)], axis=1).astype(np.uint8)
+
+    def append(self, name, array):
+        """Дописывает строки в файл индекса (хвост от прерванной записи, не попавший в meta.json, отбрасывается)."""
+        path = self.file(name)
+        with open(path, 'ab') as f:
+            f.truncate(len(self) * array[0].nbytes)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(array).tobytes())
+
+    def add(self, digests, vectors):
+        """Добавляет векторы изображений, которых еще нет в индексе. Возвращает число добавленных."""
+        if not self.trained:
+            raise RuntimeError(f"Индекс {self.folder} не обучен")
+        new = {}
+        for digest, vector in zip(digests, vectors):
+            if digest not in self.rows and digest not in new:
+                new[digest] = vector
+        if not new:
+            return 0
+        vectors = normalize(list(new.values()))
+        if self.meta['storage'] == 'pq':
+            self.append('codes.bin', self.encode(vectors))
+        else:
+            self.append('vectors.bin', vectors.astype(np.float16))
+        if self.centroids is not None:
+            self.append('lists.bin', nearest_centroids(vectors, self.centroids).astype(np.int32))
+
+        for digest in new:
+            self.rows[digest] = len(self.meta['digests'])
+            self.meta['digests'].append(digest)
+        self._data = self._lists = None
+        self.flush()
+        return len(new)
+
+    def flush(self):
+        tmp_path = self.meta_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.meta_file)
+
+    def data(self):
+        """Векторы float16 (N x d) или коды PQ (N x m) в memmap."""
+        if self._data is None and len(self):
+            if self.meta['storage'] == 'pq':
+                self._data = np.memmap(self.file('codes.bin'), dtype=np.uint8, mode='r', shape=(len(self), self.meta['pq_subvectors']))
+            else:
+                self._data = np.memmap(self.file('vectors.bin'), dtype=np.float16, mode='r', shape=(len(self), self.meta['dim']))
+        return self._data
+
+    def inverted_lists(self):
+        """Строки по кластерам IVF: (строки, отсортированные по кластеру, границы кластеров); внутри кластера строки по возрастанию."""
+        if self._lists is None:
+            assignments = np.memmap(self.file('lists.bin'), dtype=np.int32, mode='r', shape=(len(self),))
+            order = np.argsort(assignments, kind='stable')
+            bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+            self._lists = order, bounds
+        return self._lists
+
+    def scorer(self, queries):
+        """Функция (номера запросов, строки) -> скоры Q x n: скалярное произведение или его оценка по кодам PQ."""
+        data = self.data()
+        if self.meta['storage'] != 'pq':
+            return lambda query_rows, rows: queries[query_rows] @ np.asarray(data[rows], dtype=np.float32).T
+        m = self.meta['pq_subvectors']
+        # Таблицы скоров подвекторов запросов с центроидами PQ: Q x m x 256
+        tables = np.einsum('qmd,mkd->qmk', queries.reshape(len(queries), m, -1), self.codebooks)
+        return lambda query_rows, rows: tables[query_rows][:, np.arange(m), np.asarray(data[rows])].sum(axis=2)
+
+    def search(self, queries, k=50, nprobe=None, exact=False, block_size=65536):
+        """
+        Поиск k ближайших векторов для батча запросов (Q x d). exact=True (или индекс без IVF) - перебор
+        всего индекса блоками, иначе просматриваются nprobe ближайших кластеров IVF.
+        Возвращает для каждого запроса список пар (хэш изображения, скор) по убыванию скора.
+        """
+        queries = normalize(queries)
+        if not len(self):
+            return [[] for _ in queries]
+        score = self.scorer(queries)
+        all_queries = np.arange(len(queries))
+
+        if exact or self.centroids is None:
+            if self.meta['storage'] == 'pq':
+                # Скоры по кодам PQ занимают Q x блок x m, блок уменьшается пропорционально
+                block_size = max(1024, block_size * 16 // (len(queries) * self.meta['pq_subvectors']))
+            blocks = (
+                (np.arange(start, min(start + block_size, len(self))), score(all_queries, slice(start, start + block_size)))
+                for start in range(0, len(self), block_size)
+            )
+            scores, rows = search_blocks(len(queries), blocks, k)
+        else:
+            order, bounds = self.inverted_lists()
+            probes = nearest_centroids(queries, self.centroids, n=min(nprobe or 1, len(self.centroids)))
+            probes = probes.reshape(len(queries), -1)
+            candidates = [[] for _ in queries]
+            # Кластер считывается один раз для всех запросов батча, которые его просматривают
+            for cluster in np.unique(probes):
+                rows = order[bounds[cluster]:bounds[cluster + 1]]
+                if not len(rows):
+                    continue
+                query_rows = np.nonzero((probes == cluster).any(axis=1))[0]
+                for query_row, cluster_scores in zip(query_rows, score(query_rows, rows)):
+                    candidates[query_row].append((rows, cluster_scores))
+            scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+            rows = np.full((len(queries), k), -1, dtype=np.int64)
+            for query_row, parts in enumerate(candidates):
+                if parts:
+                    query_scores, query_rows = search_blocks(1, ((r, s[None, :]) for r, s in parts), k)
+                    scores[query_row], rows[query_row] = query_scores[0], query_rows[0]
+
+        digests = self.meta['digests']
+        return [
+            [(digests[row], float(value)) for row, value in zip(query_rows, query_scores) if row >= 0]
+            for query_rows, query_scores in zip(rows, scores)
+        ]
@@ -1,8 +1,13 @@
 import instaloader
+import requests
 import os
 import json
 import logging
 import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from urllib.parse import urlparse
 try:
     from parsing.instagram_parser import config
@@ -11,6 +16,13 @@ except ImportError:
         from instagram_parser import config
     except ImportError:
         import config
+try:
+    from parsing import scheduler, rate_limiter, storage, media_store
+except ImportError:
+    import scheduler
+    import rate_limiter
+    import storage
+    import media_store
 
 
 # Настройка логирования (когда скрипт запускается напрямую)
@@ -23,6 +35,33 @@ logger = logging.getLogger('instagram_parser')
 
 # Убедитесь, что существует папка для хранения данных
 os.makedirs(config.DATA_FOLDER, exist_ok=True)
+os.makedirs(config.STATE_FOLDER, exist_ok=True)
+
+# Ошибки Instagram, после которых запрос повторяется с задержкой (429 и "подождите несколько минут")
+RETRYABLE_ERRORS = (
+    instaloader.exceptions.TooManyRequestsException,
+    instaloader.exceptions.QueryReturnedBadRequestException
+)
+
+# Ошибки сети при скачивании медиа, после которых загрузка повторяется
+RETRYABLE_DOWNLOAD_ERRORS = RETRYABLE_ERRORS + (requests.ConnectionError, requests.Timeout)
+
+# Пул потоков скачивания медиа и HTTP-сессии по прокси аккаунтов (создаются при первом использовании)
+_media_pool = None
+_media_sessions = {}
+_media_lock = threading.Lock()
+
+# Ошибки, связанные с аккаунтом (требование входа, челлендж - 400 от Instagram, 429): аккаунт уходит на паузу.
+# Остальные ConnectionException (профиль не найден, закрыт, удален) - ошибки конкретного профиля
+ACCOUNT_ERRORS = (
+    instaloader.exceptions.LoginRequiredException,
+    instaloader.exceptions.TwoFactorAuthRequiredException,
+    instaloader.exceptions.TooManyRequestsException,
+    instaloader.exceptions.QueryReturnedBadRequestException
+)
+
+# Имя и прокси аккаунта текущего потока пула (у каждого аккаунта свой ограничитель запросов и свой IP)
+_worker_local = threading.local()
 
 # Путь к файлу сессии
 session_file = os.path.join('parsing', 'instagram_parser', 'session_name.session')
@@ -47,37 +86,53 @@ def prompt_credentials():
     password = input("Введите ваш Instagram пароль: ").strip()
     return username, password
 
-def initialize_instaloader():
-    """Инициализация Instaloader с сохранением сессии."""
+def account_limiter():
+    """Ограничитель запросов аккаунта, от имени которого работает текущий поток."""
+    return rate_limiter.get_limiter(getattr(_worker_local, 'limiter_name', 'instagram'), config)
+
+def default_proxy():
+    """Прокси из config (если USE_PROXY) - для аккаунтов без собственного прокси."""
+    return config.PROXY_URL if config.USE_PROXY else None
+
+def initialize_instaloader(username=None, password=None, session_path=None, proxy_url=None):
+    """
+    Инициализация Instaloader с сохранением сессии. Без параметров используется основной
+    аккаунт из config (учетные данные запрашиваются, если файла сессии нет).
+    """
     loader = instaloader.Instaloader(dirname_pattern=config.DATA_FOLDER)
+    username = username or config.INSTAGRAM_USERNAME
+    session_path = session_path or session_file
+    if proxy_url is None:
+        proxy_url = default_proxy()
     
     # Проверка флага USE_PROXY перед настройкой прокси
-    if config.USE_PROXY and config.PROXY_URL is not None:
-        proxy_info = parse_proxy_url(config.PROXY_URL)
+    if proxy_url is not None:
+        proxy_info = parse_proxy_url(proxy_url)
         loader.context.proxy = f'{proxy_info["proxy_type"]}://{proxy_info["username"]}:{proxy_info["password"]}@{proxy_info["addr"]}:{proxy_info["port"]}'
-        logger.info(f'Используется прокси (Instagram): {config.PROXY_URL}')
-        print(f'Используется прокси (Instagram): {config.PROXY_URL}')
+        logger.info(f'Используется прокси (Instagram): {proxy_url}')
+        print(f'Используется прокси (Instagram): {proxy_url}')
     else:
         logger.info('Прокси не используется (Instagram).')
         print('Прокси не используется (Instagram).')
 
     # Проверим, существует ли файл сессии
-    if os.path.exists(session_file):
-        logger.info(f'Файл сессии найден: {session_file}')
+    if os.path.exists(session_path):
+        logger.info(f'Файл сессии найден: {session_path}')
         try:
-            loader.load_session_from_file(config.INSTAGRAM_USERNAME, session_file)
+            loader.load_session_from_file(username, session_path)
             logger.info("Сессия загружена успешно.")
         except Exception as e:
             logger.error(f"Ошибка при загрузке сессии: {e}")
             return None
     else:
         logger.info('Файл сессии не найден. Запрашиваем учетные данные для создания новой сессии.')
-        username, password = prompt_credentials()
+        if password is None:
+            username, password = prompt_credentials()
 
         try:
             loader.login(username, password)
             # Сохраняем сессию, только если логин успешен
-            loader.save_session_to_file(session_file)
+            loader.save_session_to_file(session_path)
             logger.info("Сессия успешно создана и сохранена.")
         except instaloader.exceptions.BadCredentialsException:
             logger.error("Неверные учетные данные для входа.")
@@ -92,7 +147,9 @@ def initialize_instaloader():
 def fetch_profile_posts(loader, profile_name):
     """Получение всех постов профиля."""
     try:
-        profile = instaloader.Profile.from_username(loader.context, profile_name)
+        profile = account_limiter().call(
+            'profile', instaloader.Profile.from_username, loader.context, profile_name, retry_on=RETRYABLE_ERRORS
+        )
         
         # Логирование общей информации о профиле
         logger.info(f"Парсинг профиля: {profile_name}")
@@ -101,16 +158,125 @@ def fetch_profile_posts(loader, profile_name):
         
         posts = profile.get_posts()
         return posts
+    except ACCOUNT_ERRORS:
+        # Проблемы аккаунта обрабатываются выше (пауза аккаунта в пуле)
+        raise
     except Exception as e:
         logger.error(f"Ошибка при получении постов профиля {profile_name}: {e}")
-        return []
+        return None
 
-def download_media(post, profile_name):
-    """Скачивание только медиафайлов с изображениями в папку media."""
-    media_folder = os.path.join(config.DATA_FOLDER, profile_name, 'media')
-    os.makedirs(media_folder, exist_ok=True)
+def load_profile_state(profile_name):
+    """
+    Состояние профиля: отметка самого нового сохраненного поста, признак завершенного обхода истории и
+    отложенная отметка (pending_*) прохода, прерванного по POST_LIMIT до старой отметки.
+    """
+    state = {
+        'latest_date': None, 'latest_shortcode': None, 'backfill_done': False,
+        'pending_latest_date': None, 'pending_latest_shortcode': None
+    }
+    state_file = os.path.join(config.STATE_FOLDER, f'{profile_name}_state.json')
+    if os.path.exists(state_file):
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state.update(json.load(f))
+    return state
 
-    media_paths = []
+def save_profile_state(profile_name, state):
+    """Сохранение состояния профиля (через временный файл, чтобы не оставить его обрезанным)."""
+    state_file = os.path.join(config.STATE_FOLDER, f'{profile_name}_state.json')
+    with open(state_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=4)
+    os.replace(state_file + '.tmp', state_file)
+
+def save_iterator_state(profile_name, posts):
+    """Сохраняет состояние NodeIterator (freeze), чтобы прерванный обход истории продолжился с этого места."""
+    resume_file = os.path.join(config.STATE_FOLDER, f'{profile_name}_resume.json')
+    with open(resume_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(posts.freeze()._asdict(), f, ensure_ascii=False)
+    os.replace(resume_file + '.tmp', resume_file)
+
+def resume_iterator(profile_name, posts):
+    """Восстанавливает сохраненное состояние NodeIterator (thaw). Возвращает True, если обход продолжен."""
+    resume_file = os.path.join(config.STATE_FOLDER, f'{profile_name}_resume.json')
+    if not os.path.exists(resume_file):
+        return False
+    try:
+        with open(resume_file, 'r', encoding='utf-8') as f:
+            posts.thaw(instaloader.FrozenNodeIterator(**json.load(f)))
+        logger.info(f"Обход истории профиля {profile_name} продолжен с сохраненного места.")
+        return True
+    except Exception as e:
+        # Состояние устарело или не подходит к итератору - начинаем обход заново
+        logger.warning(f"Не удалось продолжить обход профиля {profile_name}: {e}")
+        os.remove(resume_file)
+        return False
+
+def clear_iterator_state(profile_name):
+    resume_file = os.path.join(config.STATE_FOLDER, f'{profile_name}_resume.json')
+    if os.path.exists(resume_file):
+        os.remove(resume_file)
+
+def get_media_pool(proxy_url=None):
+    """
+    Пул потоков скачивания (общий) и HTTP-сессия с пулом соединений (переиспользование keep-alive)
+    для прокси аккаунта: медиа скачиваются через тот же IP, что и запросы аккаунта к Instagram.
+    """
+    global _media_pool
+    with _media_lock:
+        if _media_pool is None:
+            _media_pool = ThreadPoolExecutor(max_workers=config.MEDIA_DOWNLOAD_WORKERS)
+        session = _media_sessions.get(proxy_url)
+        if session is None:
+            session = _media_sessions[proxy_url] = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=config.MEDIA_DOWNLOAD_WORKERS, pool_maxsize=config.MEDIA_DOWNLOAD_WORKERS
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            if config.USER_AGENT:
+                session.headers['User-Agent'] = config.USER_AGENT
+            if proxy_url is not None:
+                session.proxies = {'http': proxy_url, 'https': proxy_url}
+        return _media_pool, session
+
+def stream_to_file(session, url, file_path):
+    """Скачивает url во временный файл и атомарно переименовывает его в file_path."""
+    tmp_path = file_path + '.part'
+    with session.get(url, stream=True, timeout=config.MEDIA_DOWNLOAD_TIMEOUT) as response:
+        if response.status_code == 429:
+            raise instaloader.exceptions.TooManyRequestsException(f'429 при скачивании {url}')
+        response.raise_for_status()
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                f.write(chunk)
+    # Файл появляется под итоговым именем только целиком, поэтому os.path.exists не примет обрезанный файл за готовый
+    os.replace(tmp_path, file_path)
+
+def media_source(url):
+    """
+    Стабильный идентификатор изображения: имя файла на CDN (подписанные параметры ссылки меняются,
+    имя файла - нет, в том числе в репостах того же изображения).
+    """
+    return 'instagram:' + os.path.basename(urlparse(url).path)
+
+def fetch_to_store(session, url, source):
+    """Скачивает изображение во временный файл и переносит его в хранилище медиа по хэшу содержимого."""
+    media = media_store.get_media_store(config)
+    tmp_path = media.temp_path(source)
+    stream_to_file(session, url, tmp_path)
+    return media.add_file(tmp_path, source)
+
+def download_file(url):
+    # Ограничитель и прокси берутся в потоке аккаунта: потоки пула скачивания общие для всех аккаунтов
+    pool, session = get_media_pool(getattr(_worker_local, 'proxy_url', default_proxy()))
+    return pool.submit(
+        account_limiter().call,
+        'media', fetch_to_store, session, url, media_source(url), retry_on=RETRYABLE_DOWNLOAD_ERRORS
+    )
+
+def download_media(post, profile_name):
+    """Скачивание только медиафайлов с изображениями в хранилище медиа (параллельно, в пуле потоков)."""
+    media = media_store.get_media_store(config)
+    image_urls = []
     
     # Если пост состоит только из видео, мы его игнорируем
     if post.is_video and post.typename != 'GraphSidecar':
@@ -119,26 +285,24 @@ def download_media(post, profile_name):
 
     # Если это пост с несколькими медиа (альбом), выбираем только изображения
     if post.typename == 'GraphSidecar':
-        for index, node in enumerate(post.get_sidecar_nodes()):
+        for node in post.get_sidecar_nodes():
             # Проверяем, является ли это изображением
             if not node.is_video:
-                file_path = os.path.join(media_folder, f'{post.shortcode}_{index}.jpg')
-                media_paths.append(file_path)
-                if not os.path.exists(file_path):  # Скачиваем только если файл не существует
-                    post._context.get_and_write_raw(node.display_url, file_path)
+                image_urls.append(node.display_url)
             else:
                 logger.info(f"Видео в альбоме {post.shortcode} пропущено.")
     else:
         # Если это одиночное изображение
         if not post.is_video:
-            file_path = os.path.join(media_folder, f'{post.shortcode}.jpg')
-            media_paths.append(file_path)
-            if not os.path.exists(file_path):  # Скачиваем только если файл не существует
-                post._context.get_and_write_raw(post.url, file_path)
+            image_urls.append(post.url)
         else:
             logger.info(f"Пост {post.shortcode} содержит только видео и будет пропущен.")
 
-    return media_paths
+    # Уже известные изображения (в том числе из других профилей) берутся из хранилища без скачивания
+    media_paths = [media.lookup(media_source(url)) or download_file(url) for url in image_urls]
+
+    # Дожидаемся всех загрузок поста; ошибка любой из них пробрасывается дальше
+    return [path if isinstance(path, str) else path.result() for path in media_paths]
 
 def save_post_data(post, profile_name, stats):
     """Сохранение данных о посте в JSON файл."""
@@ -163,8 +327,9 @@ def save_post_data(post, profile_name, stats):
 
     # Пробуем получить комментарии, если они доступны
     try:
-        time.sleep(1)  # Небольшая задержка перед запросом комментариев
-        post_data['comments'] = post.comments
+        post_data['comments'] = account_limiter().call(
+            'comments', getattr, post, 'comments', retry_on=RETRYABLE_ERRORS
+        )
     except KeyError:
         logger.warning(f"Поле 'edge_media_to_parent_comment' отсутствует для поста {post.shortcode}. Пропускаем комментарии.")
     except Exception as e:
@@ -179,59 +344,247 @@ def save_post_data(post, profile_name, stats):
     if not stats['latest_post'] or post_date > stats['latest_post']:
         stats['latest_post'] = post_date
 
-    # Сохраняем данные поста в JSON файл (перезаписываем, если файл существует)
-    post_folder = os.path.join(config.DATA_FOLDER, profile_name)
-    os.makedirs(post_folder, exist_ok=True)
-    
-    post_file = os.path.join(post_folder, f"{post.shortcode}.json")
-    with open(post_file, 'w', encoding='utf-8') as f:
-        json.dump(post_data, f, ensure_ascii=False, indent=4)
+    # Сохраняем данные поста в хранилище (перезаписываем, если пост уже есть)
+    storage.get_storage(config).write_post('instagram', profile_name, post.shortcode, post_data)
     
     logger.info(f"Сохранены данные поста {post.shortcode}")
 
+def parse_profile(loader, profile_name):
+    """Парсинг одного профиля, возвращает статистику."""
+    logger.info(f"Начало парсинга профиля: {profile_name}")
+
+    stats = {
+        'profile': profile_name,
+        'post_count': 0,
+        'media_count': 0,
+        'earliest_post': None,
+        'latest_post': None
+    }
+
+    posts = fetch_profile_posts(loader, profile_name)
+    if posts is None:
+        return stats
+
+    state = load_profile_state(profile_name)
+    watermark = datetime.fromisoformat(state['latest_date']) if state['latest_date'] else None
+    newest_post = None
+
+    # В режиме обхода истории отметка не останавливает итерацию, а состояние итератора периодически сохраняется
+    backfill = config.BACKFILL and not state['backfill_done']
+    if backfill:
+        resume_iterator(profile_name, posts)
+    post_limit = config.BACKFILL_MAX_POSTS if backfill else config.POST_LIMIT
+
+    # Ограничение по количеству постов (если указано в config)
+    post_count = 0
+    caught_up = False  # Обход дошел до старой отметки или до конца ленты
+    for post in posts:
+        if newest_post is None or post.date_utc > newest_post.date_utc:
+            newest_post = post
+
+        if not backfill and watermark and post.date_utc <= watermark:
+            # Закрепленные посты идут первыми вне хронологии - их пропускаем, а не останавливаемся
+            if getattr(post, 'is_pinned', False):
+                continue
+            logger.info(f"Достигнут уже сохраненный пост {post.shortcode}, обход профиля {profile_name} завершен.")
+            caught_up = True
+            break
+
+        # Уже сохраненные посты не скачиваем повторно
+        if storage.get_storage(config).has_post('instagram', profile_name, post.shortcode):
+            continue
+
+        # Вместо фиксированной паузы между постами - ограничитель запросов
+        account_limiter().acquire('post')
+        save_post_data(post, profile_name, stats)
+        post_count += 1
+        if backfill and post_count % config.BACKFILL_CHECKPOINT_EVERY == 0:
+            save_iterator_state(profile_name, posts)
+        if post_limit and post_count >= post_limit:
+            if backfill:
+                save_iterator_state(profile_name, posts)
+            break
+    else:
+        caught_up = True
+        if backfill:
+            state['backfill_done'] = True
+            clear_iterator_state(profile_name)
+            logger.info(f"История профиля {profile_name} полностью загружена.")
+
+    # Самый новый пост прохода с учетом отложенной отметки прошлых неполных проходов
+    newest = state['pending_latest_date'], state['pending_latest_shortcode']
+    if newest_post is not None and (newest[0] is None or newest_post.date_utc > datetime.fromisoformat(newest[0])):
+        newest = newest_post.date_utc.isoformat(), newest_post.shortcode
+    if backfill or caught_up:
+        if newest[0] is not None and (watermark is None or datetime.fromisoformat(newest[0]) > watermark):
+            state['latest_date'], state['latest_shortcode'] = newest
+        state['pending_latest_date'] = state['pending_latest_shortcode'] = None
+    else:
+        # Лимит POST_LIMIT исчерпан раньше старой отметки: посты между ними еще не сохранены, поэтому отметка
+        # не сдвигается (следующий запуск пропустит уже сохраненные посты и продолжит), а новая откладывается
+        logger.info(f"Лимит постов профиля {profile_name} исчерпан до сохраненной отметки, обход продолжится в следующий раз.")
+        state['pending_latest_date'], state['pending_latest_shortcode'] = newest
+    save_profile_state(profile_name, state)
+
+    # Логирование результатов
+    logger.info(f'Профиль: {profile_name}')
+    logger.info(f'Скачано постов: {stats["post_count"]}')
+    logger.info(f'Скачано медиафайлов: {stats["media_count"]}')
+    logger.info(f'Самый ранний пост: {stats["earliest_post"]}')
+    logger.info(f'Самый поздний пост: {stats["latest_post"]}')
+
+    # Вывод в консоль (временно для дебага)
+    print(f'Профиль: {profile_name}')
+    print(f'Скачано постов: {stats["post_count"]}')
+    print(f'Скачано медиафайлов: {stats["media_count"]}')
+    print(f'Самый ранний пост: {stats["earliest_post"]}')
+    print(f'Самый поздний пост: {stats["latest_post"]}')
+    print('-' * 40)
+    return stats
+
+def parse_profiles(loader, profiles):
+    """Последовательный парсинг профилей одним аккаунтом. Ошибка профиля не прерывает остальные."""
+    results = []
+    for profile_name in profiles:
+        try:
+            results.append(parse_profile(loader, profile_name))
+        except Exception as e:
+            logger.error(f"Ошибка при парсинге профиля {profile_name}: {e}")
+    return results
+
+def expected_cost(profile_name):
+    """Ожидаемая длительность парсинга профиля (по прошлому запуску) в секундах."""
+    return load_profile_state(profile_name).get('last_cost') or config.DEFAULT_PROFILE_COST
+
+def create_workers(accounts):
+    """Инициализация аккаунтов пула: у каждого свой Instaloader, файл сессии и прокси."""
+    workers = []
+    for account in accounts:
+        session_path = account.get('session_file') or os.path.join(
+            'parsing', 'instagram_parser', f'session_{account["username"]}.session'
+        )
+        loader = initialize_instaloader(account['username'], account.get('password'), session_path, account.get('proxy'))
+        if loader is None:
+            logger.error(f"Аккаунт {account['username']} не инициализирован и исключен из пула.")
+            continue
+        workers.append({
+            'name': account['username'],
+            'loader': loader,
+            'proxy': account.get('proxy') or default_proxy(),
+            'cooldown_until': 0.0,
+            'failures': 0,
+            'processed': 0
+        })
+    return workers
+
+def pool_worker(worker, tasks, results, results_lock):
+    """Поток аккаунта: берет профили из общей очереди, при проблемах аккаунта уходит на паузу."""
+    _worker_local.limiter_name = f'instagram:{worker["name"]}'
+    _worker_local.proxy_url = worker['proxy']
+    while True:
+        # Аккаунт на паузе не берет задачи, чтобы их забрали здоровые аккаунты
+        wait = worker['cooldown_until'] - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            neg_cost, seq, profile_name, attempts = tasks.get_nowait()
+        except queue.Empty:
+            return
+
+        started = time.monotonic()
+        try:
+            stats = parse_profile(worker['loader'], profile_name)
+        except ACCOUNT_ERRORS as e:
+            worker['failures'] += 1
+            cooldown = min(config.WORKER_COOLDOWN_MAX, config.WORKER_COOLDOWN * 2 ** (worker['failures'] - 1))
+            worker['cooldown_until'] = time.time() + cooldown
+            logger.warning(f"Аккаунт {worker['name']}: {e!r}. Пауза {cooldown} секунд.")
+            if attempts + 1 < config.PROFILE_MAX_ATTEMPTS:
+                tasks.put((neg_cost, seq, profile_name, attempts + 1))
+            else:
+                logger.error(f"Профиль {profile_name} пропущен после {attempts + 1} попыток.")
+            continue
+        except Exception as e:
+            logger.error(f"Ошибка при парсинге профиля {profile_name}: {e}")
+            continue
+
+        worker['failures'] = 0
+        worker['processed'] += 1
+        state = load_profile_state(profile_name)
+        state['last_cost'] = time.monotonic() - started
+        save_profile_state(profile_name, state)
+        with results_lock:
+            results.append(stats)
+
+def run_worker_pool(workers, profiles):
+    """
+    Параллельный парсинг профилей пулом аккаунтов. Профили берутся из общей очереди,
+    самые затратные - первыми, чтобы нагрузка распределялась равномерно.
+    """
+    tasks = queue.PriorityQueue()
+    for seq, profile_name in enumerate(profiles):
+        tasks.put((-expected_cost(profile_name), seq, profile_name, 0))
+
+    results = []
+    results_lock = threading.Lock()
+    threads = [
+        threading.Thread(target=pool_worker, args=(worker, tasks, results, results_lock), name=f'instagram-{worker["name"]}')
+        for worker in workers
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for worker in workers:
+        logger.info(f"Аккаунт {worker['name']}: обработано профилей {worker['processed']}")
+    return results
+
+def run_scheduled(parse_batch, profiles):
+    """Периодический опрос профилей по адаптивному расписанию (см. parsing/scheduler.py)."""
+    schedule = scheduler.new_schedule(profiles, config)
+    while True:
+        due = scheduler.pop_due_sources(schedule)
+        if due:
+            results = {stats['profile']: stats for stats in parse_batch(due)}
+            for profile_name in due:
+                # Профиль, который не удалось обработать, опрашивается снова с прежним интервалом
+                stats = results.get(profile_name, {'post_count': 0, 'error': 'failed'})
+                # Запрос профиля + запрос на каждый пост (комментарии)
+                interval = scheduler.record_poll(schedule, profile_name, stats, requests=1 + stats['post_count'])
+                logger.info(f'Следующий опрос профиля {profile_name} через {interval:.0f} секунд')
+            scheduler.save_schedule(schedule)
+
+        delay = scheduler.seconds_until_next(schedule)
+        logger.info(f'Ожидание {delay:.0f} секунд до следующего опроса')
+        time.sleep(delay)
+
 def __main__():
     """Главная функция, управляющая процессом парсинга."""
-    loader = initialize_instaloader()
-    
-    if loader is None:
-        logger.error("Instaloader не инициализирован.")
-        return
-    
-    for profile_name in config.INSTAGRAM_PROFILES:
-        logger.info(f"Начало парсинга профиля: {profile_name}")
+    if config.INSTAGRAM_ACCOUNTS:
+        # Пул аккаунтов: пропускная способность растет с числом аккаунтов
+        workers = create_workers(config.INSTAGRAM_ACCOUNTS)
+        if not workers:
+            logger.error("Ни один аккаунт пула не инициализирован.")
+            return
 
-        stats = {
-            'post_count': 0,
-            'media_count': 0,
-            'earliest_post': None,
-            'latest_post': None
-        }
-
-        posts = fetch_profile_posts(loader, profile_name)
+        def parse_batch(profiles):
+            return run_worker_pool(workers, profiles)
+    else:
+        loader = initialize_instaloader()
         
-        # Ограничение по количеству постов (если указано в config)
-        post_count = 0
-        for post in posts:
-            save_post_data(post, profile_name, stats)
-            post_count += 1
-            time.sleep(2.5)  # Пауза между постами (увеличена до 2.5 секунд)
-            if config.POST_LIMIT and post_count >= config.POST_LIMIT:
-                break
-
-        # Логирование результатов
-        logger.info(f'Профиль: {profile_name}')
-        logger.info(f'Скачано постов: {stats["post_count"]}')
-        logger.info(f'Скачано медиафайлов: {stats["media_count"]}')
-        logger.info(f'Самый ранний пост: {stats["earliest_post"]}')
-        logger.info(f'Самый поздний пост: {stats["latest_post"]}')
-
-        # Вывод в консоль (временно для дебага)
-        print(f'Профиль: {profile_name}')
-        print(f'Скачано постов: {stats["post_count"]}')
-        print(f'Скачано медиафайлов: {stats["media_count"]}')
-        print(f'Самый ранний пост: {stats["earliest_post"]}')
-        print(f'Самый поздний пост: {stats["latest_post"]}')
-        print('-' * 40)
+        if loader is None:
+            logger.error("Instaloader не инициализирован.")
+            return
+
+        def parse_batch(profiles):
+            return parse_profiles(loader, profiles)
+
+    if config.SCHEDULE_MODE:
+        run_scheduled(parse_batch, config.INSTAGRAM_PROFILES)
+        return
+
+    parse_batch(config.INSTAGRAM_PROFILES)
 
 if __name__ == '__main__':
     __main__()
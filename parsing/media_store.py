@@ -0,0 +1,115 @@
+import os
+import re
+import sqlite3
+import uuid
+import hashlib
+import threading
+
+
+# Общее для обоих парсеров хранилище медиа с адресацией по содержимому: файл лежит по пути
+# <root>/<первые 2 символа хэша>/<sha256>.jpg, поэтому одно и то же изображение, опубликованное
+# в нескольких каналах или на обеих платформах, хранится (и классифицируется) один раз.
+# Таблица псевдонимов связывает стабильные идентификаторы файлов платформы (например, id фото
+# Telegram) с хэшем содержимого, что позволяет не скачивать уже известный файл повторно.
+
+DIGEST_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """SHA-256 содержимого файла."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def digest_from_path(path):
+    """Хэш из пути файла хранилища или None, если путь в старом формате (<channel>/media/<id>.jpg)."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    return name if DIGEST_PATTERN.fullmatch(name) else None
+
+def media_digest(path):
+    """Хэш содержимого медиафайла: из имени для файлов хранилища, иначе по содержимому файла."""
+    return digest_from_path(path) or hash_file(path)
+
+class MediaStore:
+    """Файлы по хэшу содержимого и таблица псевдонимов (идентификатор платформы -> хэш) в SQLite."""
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_folder = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_folder, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, 'aliases.sqlite'), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS aliases (source TEXT PRIMARY KEY, digest TEXT NOT NULL, ext TEXT NOT NULL)'
+        )
+        self.conn.commit()
+        self.duplicates = 0
+
+    def path(self, digest, ext='.jpg'):
+        return os.path.join(self.root, digest[:2], digest + ext)
+
+    def temp_path(self, name):
+        """
+        Уникальный путь для временного файла загрузки (в той же файловой системе, что и хранилище):
+        параллельные загрузки одного и того же файла (репост, повтор в альбоме) не пишут в один файл.
+        """
+        return os.path.join(self.tmp_folder, re.sub(r'[^\w.-]', '_', name) + '-' + uuid.uuid4().hex)
+
+    def lookup(self, source):
+        """Путь к уже сохраненному файлу по идентификатору платформы или None."""
+        if not source:
+            return None
+        with self.lock:
+            row = self.conn.execute('SELECT digest, ext FROM aliases WHERE source = ?', (source,)).fetchone()
+        if row is None:
+            return None
+        path = self.path(*row)
+        return path if os.path.exists(path) else None
+
+    def add_alias(self, source, digest, ext='.jpg'):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO aliases VALUES (?, ?, ?)', (source, digest, ext))
+
+    def add_file(self, tmp_path, source=None, ext='.jpg'):
+        """
+        Переносит скачанный файл в хранилище под именем по хэшу содержимого и возвращает его путь.
+        Если такой файл уже есть (дубликат из другого поста или канала), временный файл удаляется.
+        """
+        digest = hash_file(tmp_path)
+        path = self.path(digest, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            with self.lock:
+                self.duplicates += 1
+        else:
+            os.replace(tmp_path, path)
+        if source:
+            self.add_alias(source, digest, ext)
+        return path
+
+    def resolve(self, media_item):
+        """Путь к файлу для элемента media поста: путь как есть, незавершенная загрузка - по псевдониму."""
+        if os.path.exists(media_item):
+            return media_item
+        return self.lookup(media_item) or media_item
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def open_media_store(root):
+    """Открывает хранилище медиа (один экземпляр на папку в пределах процесса)."""
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = MediaStore(root)
+        return _stores[root]
+
+def get_media_store(config):
+    """Хранилище медиа по config парсера (MEDIA_STORE_FOLDER)."""
+    return open_media_store(config.MEDIA_STORE_FOLDER)
@@ -9,11 +9,13 @@ try:
     from parsing.telegram_parser.parser import __main__ as telegram_main
     from parsing.instagram_parser import config as insta_config
     from parsing.telegram_parser import config as tg_config
+    from parsing import storage
 except ImportError:
     from instagram_parser.parser import __main__ as instagram_main
     from telegram_parser.parser import __main__ as telegram_main
     from instagram_parser import config as insta_config
     from telegram_parser import config as tg_config
+    import storage
 
 # Функция для скачивания готового шаблона Excel
 def download_excel_template():
@@ -132,32 +134,17 @@ def load_channels_from_excel():
     if not insta_channels and not tg_channels:
         messagebox.showinfo("Информация", "Ни одного канала не указано для парсинга.")
 
-# Функция для подсчёта JSON и медиафайлов
+# Функция для подсчёта постов и медиафайлов (по хранилищу, без обхода директорий)
 def count_files():
-    insta_folder = 'instagram_parser/data'
-    tg_folder = 'telegram_parser/data'
-
-    insta_json_count, insta_media_count = count_directory_files(insta_folder)
-    tg_json_count, tg_media_count = count_directory_files(tg_folder)
+    insta_post_count, insta_media_count = storage.get_storage(insta_config).count('instagram')
+    tg_post_count, tg_media_count = storage.get_storage(tg_config).count('telegram')
 
     messagebox.showinfo(
         "Результаты",
-        f"Instagram: JSON файлов - {insta_json_count}, Медиафайлов - {insta_media_count}\n"
-        f"Telegram: JSON файлов - {tg_json_count}, Медиафайлов - {tg_media_count}"
+        f"Instagram: Постов - {insta_post_count}, Медиафайлов - {insta_media_count}\n"
+        f"Telegram: Постов - {tg_post_count}, Медиафайлов - {tg_media_count}"
     )
 
-# Функция для подсчёта файлов в директории
-def count_directory_files(folder):
-    json_count = 0
-    media_count = 0
-    for root, dirs, files in os.walk(folder):
-        for file in files:
-            if file.endswith('.json'):
-                json_count += 1
-            elif file.endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                media_count += 1
-    return json_count, media_count
-
 if __name__ == "__main__":
     insta_channels, tg_channels = [], []
     create_gui()
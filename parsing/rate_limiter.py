@@ -0,0 +1,139 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+
+
+# Общий ограничитель частоты запросов для парсеров Telegram и Instagram.
+# Для каждого типа запроса (endpoint) - свой token bucket; время ожидания, которое
+# сообщает сервер (FloodWaitError.seconds, Retry-After), блокирует endpoint для всех
+# вызывающих, а повторы выполняются с экспоненциальной задержкой и случайным разбросом.
+
+logger = logging.getLogger('rate_limiter')
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не более capacity токенов в запасе."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Резервирует токен и возвращает, сколько секунд нужно подождать перед запросом."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Токен может уйти в минус: это очередь уже зарезервированных запросов
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def block(self, seconds):
+        """Запрещает запросы на seconds секунд (например, по FloodWait от сервера)."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class RateLimiter:
+    """
+    Набор token bucket по endpoint'ам. limits - словарь {endpoint: (запросов в минуту, burst)},
+    endpoint 'default' используется для всех незаданных.
+    """
+
+    def __init__(self, limits, max_retries=5, backoff_base=2.0, backoff_max=300.0, max_server_wait=None):
+        self.buckets = {
+            endpoint: TokenBucket(per_minute / 60.0, burst)
+            for endpoint, (per_minute, burst) in limits.items()
+        }
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_server_wait = max_server_wait
+
+    def bucket(self, endpoint):
+        if endpoint not in self.buckets:
+            self.buckets[endpoint] = self.buckets.get('default') or TokenBucket(1.0, 1)
+        return self.buckets[endpoint]
+
+    def acquire(self, endpoint):
+        """Ожидает разрешения на запрос (блокирующая версия)."""
+        wait = self.bucket(endpoint).reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, endpoint):
+        """Ожидает разрешения на запрос (для asyncio)."""
+        wait = self.bucket(endpoint).reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def penalize(self, endpoint, seconds):
+        self.bucket(endpoint).block(seconds)
+
+    def retry_delay(self, error, attempt):
+        """
+        Задержка перед повтором: время, указанное сервером (если есть), иначе
+        экспоненциальная задержка с разбросом (половина фиксирована, половина случайна).
+        """
+        server_wait = getattr(error, 'seconds', None) or getattr(error, 'retry_after', None)
+        if server_wait:
+            return float(server_wait) + random.uniform(0, 1)
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def handle_error(self, endpoint, error, attempt):
+        """Решает, повторять ли запрос после ошибки, и блокирует endpoint на время задержки."""
+        if attempt >= self.max_retries:
+            return False
+        delay = self.retry_delay(error, attempt)
+        if self.max_server_wait is not None and delay > self.max_server_wait:
+            logger.warning(f'{endpoint}: ожидание {delay:.0f} с превышает допустимое, повтор отменен.')
+            return False
+        logger.warning(f'{endpoint}: {error!r}. Повтор {attempt + 1}/{self.max_retries} через {delay:.1f} с.')
+        self.penalize(endpoint, delay)
+        return True
+
+    def call(self, endpoint, func, *args, retry_on=(Exception,), **kwargs):
+        """Вызывает func с учетом лимита endpoint и повторами при ошибках из retry_on."""
+        attempt = 0
+        while True:
+            self.acquire(endpoint)
+            try:
+                return func(*args, **kwargs)
+            except retry_on as e:
+                if not self.handle_error(endpoint, e, attempt):
+                    raise
+                attempt += 1
+
+    async def call_async(self, endpoint, func, *args, retry_on=(Exception,), **kwargs):
+        """Асинхронная версия call: func - корутинная функция."""
+        attempt = 0
+        while True:
+            await self.acquire_async(endpoint)
+            try:
+                return await func(*args, **kwargs)
+            except retry_on as e:
+                if not self.handle_error(endpoint, e, attempt):
+                    raise
+                attempt += 1
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(name, config):
+    """Общий ограничитель для парсера name, настроенный из его config (создается один раз на процесс)."""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(
+                config.RATE_LIMITS,
+                max_retries=config.RETRY_MAX_ATTEMPTS,
+                backoff_base=config.RETRY_BACKOFF_BASE,
+                backoff_max=config.RETRY_BACKOFF_MAX,
+                max_server_wait=config.MAX_FLOOD_WAIT
+            )
+        return _limiters[name]
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import heapq
+from collections import deque
+
+
+# Планировщик периодического опроса источников (каналов Telegram, профилей Instagram).
+# Источники лежат в очереди с приоритетом по времени следующего опроса; интервал каждого
+# источника подстраивается под наблюдаемую частоту публикаций, а общее число запросов
+# ограничено бюджетом REQUEST_BUDGET_PER_HOUR, чтобы тихие аккаунты не тратили квоту активных.
+# Настройки берутся из config парсера: UPDATE_INTERVAL (начальный интервал), MIN_INTERVAL,
+# MAX_INTERVAL, TARGET_POSTS_PER_POLL, SCHEDULE_BACKOFF, REQUEST_BUDGET_PER_HOUR, SCHEDULE_FILE.
+
+def new_schedule(sources, config):
+    """Создает расписание для списка источников (с учетом сохраненных интервалов, если они есть)."""
+    schedule = {
+        'config': config,
+        'heap': [],
+        'intervals': {},
+        'last_polled': {},
+        'requests': deque()
+    }
+
+    saved = {}
+    if config.SCHEDULE_FILE and os.path.exists(config.SCHEDULE_FILE):
+        with open(config.SCHEDULE_FILE, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+
+    now = time.time()
+    for source in sources:
+        interval = saved.get('intervals', {}).get(source, config.UPDATE_INTERVAL)
+        schedule['intervals'][source] = interval
+        last_polled = saved.get('last_polled', {}).get(source)
+        if last_polled:
+            schedule['last_polled'][source] = last_polled
+            due = last_polled + interval
+        else:
+            due = now
+        heapq.heappush(schedule['heap'], (due, source))
+    return schedule
+
+def save_schedule(schedule):
+    """Сохраняет интервалы и время последних опросов, чтобы адаптация переживала перезапуск."""
+    path = schedule['config'].SCHEDULE_FILE
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'intervals': schedule['intervals'], 'last_polled': schedule['last_polled']}, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+def used_budget(schedule, now):
+    """Количество запросов за последний час."""
+    requests = schedule['requests']
+    while requests and requests[0][0] <= now - 3600:
+        requests.popleft()
+    return sum(count for _, count in requests)
+
+def budget_pressure(schedule):
+    """
+    Во сколько раз ожидаемое число опросов в час превышает бюджет (не меньше 1).
+    На этот коэффициент растягиваются интервалы.
+    """
+    budget = schedule['config'].REQUEST_BUDGET_PER_HOUR
+    if not budget:
+        return 1.0
+    demand = sum(3600 / interval for interval in schedule['intervals'].values())
+    return max(1.0, demand / budget)
+
+def pop_due_sources(schedule, now=None):
+    """Извлекает источники, время опроса которых наступило (в пределах оставшегося бюджета)."""
+    now = now or time.time()
+    budget = schedule['config'].REQUEST_BUDGET_PER_HOUR
+    remaining = budget - used_budget(schedule, now) if budget else None
+
+    due = []
+    while schedule['heap'] and schedule['heap'][0][0] <= now:
+        if remaining is not None and len(due) >= remaining:
+            break
+        _, source = heapq.heappop(schedule['heap'])
+        due.append(source)
+    return due
+
+def seconds_until_next(schedule, now=None):
+    """Сколько секунд ждать до следующего опроса (с учетом исчерпанного бюджета)."""
+    now = now or time.time()
+    if not schedule['heap']:
+        return schedule['config'].MAX_INTERVAL
+
+    delay = max(0.0, schedule['heap'][0][0] - now)
+    budget = schedule['config'].REQUEST_BUDGET_PER_HOUR
+    if budget and used_budget(schedule, now) >= budget and schedule['requests']:
+        # Ждем, пока самый старый запрос не выйдет из часового окна
+        delay = max(delay, schedule['requests'][0][0] + 3600 - now)
+    return delay
+
+def estimate_interval(schedule, source, stats, now):
+    """
+    Новый интервал опроса по статистике прохода (post_count, earliest_post, latest_post):
+    интервал, за который источник в среднем публикует TARGET_POSTS_PER_POLL постов.
+    Если новых постов нет - интервал увеличивается в SCHEDULE_BACKOFF раз.
+    """
+    config = schedule['config']
+    interval = schedule['intervals'][source]
+
+    if stats.get('error'):
+        desired = interval
+    elif not stats['post_count']:
+        desired = interval * config.SCHEDULE_BACKOFF
+    else:
+        last_polled = schedule['last_polled'].get(source)
+        if last_polled:
+            window = now - last_polled
+        elif stats['post_count'] > 1 and stats['earliest_post'] and stats['latest_post']:
+            # Первый опрос: оцениваем частоту по датам полученных постов
+            span = (stats['latest_post'] - stats['earliest_post']).total_seconds()
+            window = span * stats['post_count'] / (stats['post_count'] - 1)
+        else:
+            window = interval
+        rate = stats['post_count'] / max(window, 1.0)
+        # Сглаживаем, чтобы единичный всплеск не менял интервал резко
+        desired = (interval + config.TARGET_POSTS_PER_POLL / rate) / 2
+
+    return min(config.MAX_INTERVAL, max(config.MIN_INTERVAL, desired))
+
+def record_poll(schedule, source, stats, requests=1, now=None):
+    """Учитывает результат опроса источника и ставит его следующий опрос в очередь."""
+    now = now or time.time()
+    interval = estimate_interval(schedule, source, stats, now)
+    schedule['intervals'][source] = interval
+    schedule['last_polled'][source] = now
+    schedule['requests'].append((now, requests))
+
+    interval = min(schedule['config'].MAX_INTERVAL, interval * budget_pressure(schedule))
+    heapq.heappush(schedule['heap'], (now + interval, source))
+    return interval
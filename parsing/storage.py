@@ -0,0 +1,438 @@
+import os
+import json
+import sqlite3
+import logging
+import argparse
+import threading
+from datetime import datetime, timezone
+
+
+# Хранилище постов парсеров. Пост адресуется тройкой (platform, channel, post_id), где platform -
+# 'telegram' или 'instagram', channel - канал/профиль, post_id - id сообщения или shortcode.
+# Бэкенды:
+#   json   - текущий формат: <DATA_FOLDER>/<channel>/<post_id>.json, по одному файлу на пост;
+#   sqlite - одна база SQLite в режиме WAL с индексом по платформе, каналу и дате;
+#   jsonl  - append-only сегменты JSONL (обновление - новая строка, удаление - строка с data=None).
+# У всех бэкендов одинаковый интерфейс: write_post/write_posts, get_post, has_post, delete_post,
+# query (выборка с фильтрами) и count (вместо обхода директорий).
+
+logger = logging.getLogger('storage')
+
+def normalize_date(value):
+    """Дата поста в виде строки ISO в UTC без часового пояса (для сортировки и сравнения строк)."""
+    if not value:
+        return ''
+    date = datetime.fromisoformat(value) if isinstance(value, str) else value
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date.isoformat()
+
+# Расширения медиафайлов при подсчете по списку файлов (бэкенд json)
+MEDIA_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+
+def media_count(data):
+    return len(data.get('media') or [])
+
+def in_range(date, since, until):
+    return (not since or date >= normalize_date(since)) and (not until or date <= normalize_date(until))
+
+class JsonStorage:
+    """Один JSON на пост: <root>/<channel>/<post_id>.json (platform задается выбором root)."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, channel, post_id):
+        return os.path.join(self.root, channel, f'{post_id}.json')
+
+    def write_post(self, platform, channel, post_id, data):
+        path = self.path(channel, post_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        os.replace(path + '.tmp', path)
+
+    def write_posts(self, records):
+        for platform, channel, post_id, data in records:
+            self.write_post(platform, channel, post_id, data)
+
+    def get_post(self, platform, channel, post_id):
+        path = self.path(channel, post_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def has_post(self, platform, channel, post_id):
+        return os.path.exists(self.path(channel, post_id))
+
+    def delete_post(self, platform, channel, post_id):
+        path = self.path(channel, post_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def query(self, platform=None, channel=None, since=None, until=None):
+        """Перебор постов (platform, channel, post_id, data) с фильтрами по каналу и дате."""
+        if channel:
+            channels = [channel]
+        elif os.path.isdir(self.root):
+            channels = sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+        else:
+            channels = []
+
+        for channel_name in channels:
+            folder = os.path.join(self.root, channel_name)
+            if not os.path.isdir(folder):
+                continue
+            for file in sorted(os.listdir(folder)):
+                if not file.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(folder, file), 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if (since or until) and not in_range(normalize_date(data.get('date')), since, until):
+                    continue
+                yield platform, channel_name, file[:-len('.json')], data
+
+    def count(self, platform=None, channel=None):
+        """
+        Количество постов (файлов .json) и медиафайлов в папках каналов - по списку файлов, без чтения
+        JSON каждого поста (подсчет для GUI на больших папках).
+        """
+        post_count = media_total = 0
+        folder = os.path.join(self.root, channel) if channel else self.root
+        for root, dirs, files in os.walk(folder):
+            for file in files:
+                if file.endswith('.json'):
+                    post_count += 1
+                elif file.lower().endswith(MEDIA_EXTENSIONS):
+                    media_total += 1
+        return post_count, media_total
+
+    def close(self):
+        pass
+
+class SQLiteStorage:
+    """Все посты в одной базе SQLite (режим WAL: запись не блокирует чтение)."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS posts ('
+            ' platform TEXT NOT NULL, channel TEXT NOT NULL, post_id TEXT NOT NULL,'
+            ' date TEXT NOT NULL, media_count INTEGER NOT NULL, data TEXT NOT NULL,'
+            ' PRIMARY KEY (platform, channel, post_id))'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS posts_date ON posts (platform, channel, date)')
+        self.conn.commit()
+
+    def write_posts(self, records):
+        rows = [
+            (platform, channel, str(post_id), normalize_date(data.get('date')), media_count(data),
+             json.dumps(data, ensure_ascii=False))
+            for platform, channel, post_id, data in records
+        ]
+        # UPSERT, а не INSERT OR REPLACE: строка обновляется на месте (тот же rowid), поэтому запись
+        # во время обхода query (скоры классификатора) не сдвигает незавершенную выборку
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT INTO posts VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (platform, channel, post_id) DO UPDATE SET'
+                ' date = excluded.date, media_count = excluded.media_count, data = excluded.data', rows
+            )
+
+    def write_post(self, platform, channel, post_id, data):
+        self.write_posts([(platform, channel, post_id, data)])
+
+    def get_post(self, platform, channel, post_id):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT data FROM posts WHERE platform = ? AND channel = ? AND post_id = ?',
+                (platform, channel, str(post_id))
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def has_post(self, platform, channel, post_id):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT 1 FROM posts WHERE platform = ? AND channel = ? AND post_id = ?',
+                (platform, channel, str(post_id))
+            ).fetchone()
+        return row is not None
+
+    def delete_post(self, platform, channel, post_id):
+        with self.lock, self.conn:
+            self.conn.execute(
+                'DELETE FROM posts WHERE platform = ? AND channel = ? AND post_id = ?',
+                (platform, channel, str(post_id))
+            )
+
+    def where(self, platform, channel, since=None, until=None):
+        conditions, params = [], []
+        for column, value in (('platform', platform), ('channel', channel)):
+            if value:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if since:
+            conditions.append('date >= ?')
+            params.append(normalize_date(since))
+        if until:
+            conditions.append('date <= ?')
+            params.append(normalize_date(until))
+        return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+    def query(self, platform=None, channel=None, since=None, until=None, batch_size=1000):
+        where, params = self.where(platform, channel, since, until)
+        with self.lock:
+            cursor = self.conn.execute(
+                f'SELECT platform, channel, post_id, data FROM posts{where} ORDER BY platform, channel, date', params
+            )
+        while True:
+            # Читаем порциями, чтобы не держать всю выборку в памяти
+            with self.lock:
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row_platform, row_channel, post_id, data in rows:
+                yield row_platform, row_channel, post_id, json.loads(data)
+
+    def count(self, platform=None, channel=None):
+        where, params = self.where(platform, channel)
+        with self.lock:
+            row = self.conn.execute(f'SELECT COUNT(*), COALESCE(SUM(media_count), 0) FROM posts{where}', params).fetchone()
+        return row[0], row[1]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class JsonlStorage:
+    """
+    Append-only сегменты <root>/segment-NNNNNN.jsonl. Индекс (ключ -> сегмент и смещение строки)
+    строится при открытии одним последовательным чтением сегментов; последняя запись ключа побеждает.
+    """
+
+    def __init__(self, root, segment_max_bytes=64 * 1024 * 1024):
+        self.root = root
+        self.segment_max_bytes = segment_max_bytes
+        self.lock = threading.Lock()
+        self.index = {}
+        os.makedirs(root, exist_ok=True)
+        self.segments = sorted(name for name in os.listdir(root) if name.startswith('segment-') and name.endswith('.jsonl'))
+        for segment in self.segments:
+            self.load_segment(segment, last=segment == self.segments[-1])
+        if not self.segments:
+            self.segments.append(self.segment_name(1))
+
+    def segment_name(self, number):
+        return f'segment-{number:06d}.jsonl'
+
+    def next_segment_name(self):
+        """Имя следующего сегмента: номер последнего + 1 (номера растут и после compact)."""
+        return self.segment_name(int(self.segments[-1][8:14]) + 1)
+
+    def load_segment(self, segment, last=False):
+        """
+        Добавляет записи сегмента в индекс. Поврежденные строки пропускаются; недописанная строка в конце
+        последнего (открытого на запись) сегмента после сбоя обрезается, иначе следующая запись допишется
+        к обрывку и испортит строку.
+        """
+        path = os.path.join(self.root, segment)
+        torn_offset = None
+        with open(path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    torn_offset = offset
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f'Поврежденная запись в сегменте {path} (смещение {offset}) пропущена')
+                    offset += len(line)
+                    continue
+                key = (record['platform'], record['channel'], str(record['post_id']))
+                if record['data'] is None:
+                    self.index.pop(key, None)
+                else:
+                    self.index[key] = (segment, offset, record['date'], record['media_count'])
+                offset += len(line)
+        if torn_offset is not None:
+            if last:
+                logger.warning(f'Сегмент {path} обрезан до {torn_offset} байт (недописанная запись)')
+                with open(path, 'r+b') as f:
+                    f.truncate(torn_offset)
+            else:
+                logger.warning(f'Недописанная запись в конце закрытого сегмента {path} пропущена')
+
+    def append(self, records):
+        with self.lock:
+            path = os.path.join(self.root, self.segments[-1])
+            # Индекс обновляется после закрытия файла: get_post читает без блокировки и не должен
+            # увидеть смещение строки, которая еще в буфере записи
+            updates = []
+            with open(path, 'ab') as f:
+                for platform, channel, post_id, data in records:
+                    key = (platform, channel, str(post_id))
+                    date = normalize_date(data.get('date')) if data is not None else ''
+                    count = media_count(data) if data is not None else 0
+                    line = json.dumps({
+                        'platform': platform, 'channel': channel, 'post_id': str(post_id),
+                        'date': date, 'media_count': count, 'data': data
+                    }, ensure_ascii=False).encode('utf-8') + b'\n'
+                    entry = (self.segments[-1], f.tell(), date, count) if data is not None else None
+                    updates.append((key, entry))
+                    f.write(line)
+                size = f.tell()
+            for key, entry in updates:
+                if entry is not None:
+                    self.index[key] = entry
+                else:
+                    self.index.pop(key, None)
+            if size >= self.segment_max_bytes:
+                self.segments.append(self.next_segment_name())
+
+    def write_posts(self, records):
+        self.append(list(records))
+
+    def write_post(self, platform, channel, post_id, data):
+        self.append([(platform, channel, post_id, data)])
+
+    def read(self, entry):
+        segment, offset = entry[0], entry[1]
+        with open(os.path.join(self.root, segment), 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())['data']
+
+    def get_post(self, platform, channel, post_id):
+        entry = self.index.get((platform, channel, str(post_id)))
+        return self.read(entry) if entry else None
+
+    def has_post(self, platform, channel, post_id):
+        return (platform, channel, str(post_id)) in self.index
+
+    def delete_post(self, platform, channel, post_id):
+        if self.has_post(platform, channel, post_id):
+            self.append([(platform, channel, post_id, None)])
+
+    def matching(self, platform=None, channel=None, since=None, until=None):
+        with self.lock:
+            items = list(self.index.items())
+        return sorted(
+            (key, entry) for key, entry in items
+            if (not platform or key[0] == platform) and (not channel or key[1] == channel)
+            and ((not since and not until) or in_range(entry[2], since, until))
+        )
+
+    def query(self, platform=None, channel=None, since=None, until=None):
+        for key, entry in self.matching(platform, channel, since, until):
+            yield key[0], key[1], key[2], self.read(entry)
+
+    def count(self, platform=None, channel=None):
+        entries = self.matching(platform, channel)
+        return len(entries), sum(entry[3] for _, entry in entries)
+
+    def compact(self):
+        """Переписывает актуальные версии постов в новые сегменты и удаляет старые."""
+        records = list(self.query())
+        old_segments = self.segments
+        with self.lock:
+            self.index = {}
+            self.segments = [self.next_segment_name()]
+        self.append(records)
+        for segment in old_segments:
+            os.remove(os.path.join(self.root, segment))
+
+    def close(self):
+        pass
+
+class BulkWriter:
+    """Накопление записей и запись пачками по batch_size (одна транзакция на пачку)."""
+
+    def __init__(self, storage, batch_size=500):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.buffer = []
+
+    def add(self, platform, channel, post_id, data):
+        self.buffer.append((platform, channel, post_id, data))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.storage.write_posts(self.buffer)
+            self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+def open_storage(backend, path, segment_max_bytes=64 * 1024 * 1024):
+    """Открывает хранилище (один экземпляр на бэкенд и путь в пределах процесса)."""
+    with _storages_lock:
+        key = (backend, path)
+        if key not in _storages:
+            if backend == 'json':
+                _storages[key] = JsonStorage(path)
+            elif backend == 'sqlite':
+                _storages[key] = SQLiteStorage(path)
+            elif backend == 'jsonl':
+                _storages[key] = JsonlStorage(path, segment_max_bytes)
+            else:
+                raise ValueError(f'Неизвестный бэкенд хранилища: {backend}')
+        return _storages[key]
+
+def get_storage(config):
+    """Хранилище парсера по его config (STORAGE_BACKEND, STORAGE_PATH; для json - DATA_FOLDER)."""
+    backend = getattr(config, 'STORAGE_BACKEND', 'json')
+    path = config.DATA_FOLDER if backend == 'json' else config.STORAGE_PATH
+    return open_storage(backend, path)
+
+def import_json_layout(target, root, platform, batch_size=500):
+    """Импорт постов из текущего формата (<root>/<channel>/<post_id>.json) в хранилище target."""
+    imported = 0
+    with BulkWriter(target, batch_size) as writer:
+        for _, channel, post_id, data in JsonStorage(root).query(platform):
+            writer.add(platform, channel, post_id, data)
+            imported += 1
+    return imported
+
+def export_json_layout(source, root, platform):
+    """Экспорт постов платформы из хранилища source в формат <root>/<channel>/<post_id>.json."""
+    target = JsonStorage(root)
+    exported = 0
+    for record in source.query(platform):
+        target.write_post(*record)
+        exported += 1
+    return exported
+
+if __name__ == '__main__':
+    # Пример: python -m parsing.storage import telegram parsing/telegram_parser/data sqlite parsing/data/posts.sqlite
+    parser = argparse.ArgumentParser(description='Импорт/экспорт постов между JSON-папками и хранилищем.')
+    parser.add_argument('action', choices=['import', 'export', 'count'])
+    parser.add_argument('platform', choices=['telegram', 'instagram'])
+    parser.add_argument('json_root', help='Папка данных парсера в формате <channel>/<post_id>.json')
+    parser.add_argument('backend', choices=['sqlite', 'jsonl'])
+    parser.add_argument('path', help='Путь к базе SQLite или папке сегментов JSONL')
+    args = parser.parse_args()
+
+    store = open_storage(args.backend, args.path)
+    if args.action == 'import':
+        print(f'Импортировано постов: {import_json_layout(store, args.json_root, args.platform)}')
+    elif args.action == 'export':
+        print(f'Экспортировано постов: {export_json_layout(store, args.json_root, args.platform)}')
+    else:
+        posts, media = store.count(args.platform)
+        print(f'Постов: {posts}, медиафайлов: {media}')
+    store.close()
@@ -0,0 +1,90 @@
+import os
+import json
+import logging
+from telethon import utils
+from telethon.errors import FloodWaitError
+from telethon.tl.types import InputPeerChannel, InputPeerUser
+try:
+    from parsing.telegram_parser import config
+except ImportError:
+    try:
+        from telegram_parser import config
+    except ImportError:
+        import config
+try:
+    from parsing import rate_limiter
+except ImportError:
+    import rate_limiter
+
+
+# Кэш разрешенных каналов (id и access_hash) хранится рядом с файлом сессии.
+# Разрешение username - один из самых ограничиваемых запросов Telegram, поэтому
+# каналы разрешаются один раз и переразрешаются только если закэшированный peer перестал работать.
+
+logger = logging.getLogger('telegram_bot_parser')
+
+def cache_key(channel):
+    return str(channel).strip('@').lower()
+
+def load_entity_cache():
+    """Загружает кэш каналов с диска."""
+    if os.path.exists(config.ENTITY_CACHE_FILE):
+        with open(config.ENTITY_CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def save_entity_cache(cache):
+    """Сохраняет кэш каналов (через временный файл, чтобы не оставить его обрезанным)."""
+    tmp_path = config.ENTITY_CACHE_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, config.ENTITY_CACHE_FILE)
+
+def cached_input_peer(cache, channel):
+    """Возвращает InputPeer из кэша или None, если канал еще не разрешался."""
+    entry = cache.get(cache_key(channel))
+    if not entry:
+        return None
+    if entry['type'] == 'channel':
+        return InputPeerChannel(entry['id'], entry['access_hash'])
+    if entry['type'] == 'user':
+        return InputPeerUser(entry['id'], entry['access_hash'])
+    return None
+
+async def resolve_channel(client, cache, channel, refresh=False):
+    """Возвращает InputPeer канала: из кэша или (при промахе или refresh=True) через get_entity."""
+    if not refresh:
+        input_peer = cached_input_peer(cache, channel)
+        if input_peer is not None:
+            return input_peer
+
+    logger.info(f'Разрешаем канал {channel} через API.')
+    entity = await rate_limiter.get_limiter('telegram', config).call_async(
+        'resolve', client.get_entity, channel, retry_on=(FloodWaitError,)
+    )
+    input_peer = utils.get_input_peer(entity)
+    if isinstance(input_peer, InputPeerChannel):
+        cache[cache_key(channel)] = {'type': 'channel', 'id': input_peer.channel_id, 'access_hash': input_peer.access_hash}
+    elif isinstance(input_peer, InputPeerUser):
+        cache[cache_key(channel)] = {'type': 'user', 'id': input_peer.user_id, 'access_hash': input_peer.access_hash}
+    save_entity_cache(cache)
+    return input_peer
+
+async def resolve_channels(client, cache, channels):
+    """
+    Заранее разрешает все еще не закэшированные каналы (например, после загрузки списка из Excel).
+    FloodWait до MAX_FLOOD_WAIT секунд пережидается ограничителем запросов, более долгий -
+    прерывает предразрешение, оставшиеся каналы будут разрешены при парсинге.
+    """
+    pending = [channel for channel in channels if cached_input_peer(cache, channel) is None]
+    if pending:
+        logger.info(f'Предварительное разрешение каналов: {len(pending)}')
+
+    for channel in pending:
+        try:
+            await resolve_channel(client, cache, channel, refresh=True)
+        except FloodWaitError as e:
+            logger.warning(f'Частые запросы при разрешении каналов ({e.seconds} с). Предразрешение прервано.')
+            return
+        except Exception as e:
+            logger.error(f'Не удалось разрешить канал {channel}: {e}')
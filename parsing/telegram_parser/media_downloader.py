@@ -0,0 +1,232 @@
+import os
+import json
+import asyncio
+import logging
+from telethon.errors import FloodWaitError
+from telethon.tl.types import PhotoSize, PhotoSizeProgressive
+try:
+    from parsing.telegram_parser import config, entity_cache
+except ImportError:
+    try:
+        from telegram_parser import config, entity_cache
+    except ImportError:
+        import config
+        import entity_cache
+try:
+    from parsing import rate_limiter, storage, media_store
+except ImportError:
+    import rate_limiter
+    import storage
+    import media_store
+
+
+# Отдельная стадия скачивания медиа: сохранение постов только ставит фото в очередь,
+# а пул из MEDIA_DOWNLOAD_WORKERS задач скачивает их параллельно.
+# Фото сохраняются в общее хранилище по хэшу содержимого (parsing/media_store.py). Пока фото
+# скачивается, в посте вместо пути стоит идентификатор фото ('telegram:<photo.id>'), который
+# после скачивания заменяется путем к файлу.
+# Неудачные скачивания (фото, канал, сообщение и ожидающие посты) сохраняются в FAILED_MEDIA_FILE
+# и в начале следующего запуска ставятся в очередь заново: инкрементальная синхронизация
+# старые сообщения повторно не читает, и без этого идентификатор остался бы в посте навсегда.
+
+logger = logging.getLogger('telegram_bot_parser')
+
+def pick_photo_size(photo):
+    """
+    Выбирает наименьший размер фото, у которого большая сторона не меньше PHOTO_MIN_SIZE
+    (классификатор CLIP все равно уменьшает изображения до 224px). Если таких нет - наибольший.
+    Возвращается тип размера (size.type): объект PhotoSizeProgressive Telethon в thumb не принимает.
+    """
+    sizes = [size for size in photo.sizes if isinstance(size, (PhotoSize, PhotoSizeProgressive))]
+    if not sizes or config.PHOTO_MIN_SIZE is None:
+        return None  # Telethon скачает наибольший размер
+
+    sizes.sort(key=lambda size: max(size.w, size.h))
+    for size in sizes:
+        if max(size.w, size.h) >= config.PHOTO_MIN_SIZE:
+            return size.type
+    return sizes[-1].type
+
+def photo_source(photo):
+    """Стабильный идентификатор фото в Telegram (id одинаков во всех каналах, куда фото переслано)."""
+    return f'telegram:{photo.id}'
+
+def stored_photo(downloader, photo):
+    """Путь к фото, если оно уже есть в хранилище медиа (скачано ранее для любого канала), иначе None."""
+    media_path = media_store.get_media_store(config).lookup(photo_source(photo))
+    if media_path is not None:
+        downloader['skipped'] += 1
+    return media_path
+
+def load_failed_media():
+    """Неудачные скачивания прошлых запусков: идентификатор фото -> канал, сообщение, посты, попытки."""
+    if os.path.exists(config.FAILED_MEDIA_FILE):
+        with open(config.FAILED_MEDIA_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def save_failed_media(failed_media):
+    """Сохраняет список неудачных скачиваний (через временный файл, чтобы не оставить его обрезанным)."""
+    os.makedirs(os.path.dirname(config.FAILED_MEDIA_FILE) or '.', exist_ok=True)
+    tmp_path = config.FAILED_MEDIA_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(failed_media, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, config.FAILED_MEDIA_FILE)
+
+def record_failure(downloader, source, channel_name, message_id):
+    """Запоминает неудачное скачивание вместе с постами, в которых остался идентификатор фото."""
+    failed_media = downloader['failed_media']
+    entry = failed_media.get(source, {'channel': channel_name, 'message_id': message_id, 'posts': [], 'attempts': 0})
+    entry['attempts'] += 1
+    for post in downloader['pending'].get(source, []):
+        if list(post) not in entry['posts']:
+            entry['posts'].append(list(post))
+    if entry['attempts'] >= config.MEDIA_RETRY_ATTEMPTS:
+        logger.warning(f'Фото {source} не скачано за {entry["attempts"]} попыток, повторов больше не будет')
+        failed_media.pop(source, None)
+    else:
+        failed_media[source] = entry
+    save_failed_media(failed_media)
+
+def waiting_posts(source, posts):
+    """Посты, в которых до сих пор стоит идентификатор фото (остальные удалены или уже получили путь)."""
+    store = storage.get_storage(config)
+    waiting = []
+    for channel_name, post_id in posts:
+        message_data = store.get_post('telegram', channel_name, post_id)
+        if message_data is not None and source in message_data.get('media', []):
+            waiting.append((channel_name, post_id))
+    return waiting
+
+def attach_media(channel_name, post_id, source, media_path):
+    """Заменяет в посте идентификатор скачанного фото путем к файлу в хранилище медиа."""
+    store = storage.get_storage(config)
+    message_data = store.get_post('telegram', channel_name, post_id)
+    if message_data is None or source not in message_data.get('media', []):
+        return
+    message_data['media'] = list(dict.fromkeys(
+        media_path if media_item == source else media_item for media_item in message_data['media']
+    ))
+    store.write_post('telegram', channel_name, post_id, message_data)
+
+async def download_worker(client, downloader):
+    """Скачивает фото из очереди, пока не получит None."""
+    queue = downloader['queue']
+    media = media_store.get_media_store(config)
+    while True:
+        item = await queue.get()
+        if item is None:
+            queue.task_done()
+            return
+
+        photo, source, channel_name, message_id = item
+        try:
+            logger.info(f'Скачиваем {source}')
+            print(f'Скачиваем {source}')
+            # Скачиваем во временный файл, в хранилище он переносится под именем по хэшу содержимого
+            tmp_path = await rate_limiter.get_limiter('telegram', config).call_async(
+                'download', client.download_media, photo, file=media.temp_path(source),
+                thumb=pick_photo_size(photo), retry_on=(FloodWaitError,)
+            )
+            if tmp_path is None:
+                raise RuntimeError('Telethon не вернул файл (размер фото не найден)')
+            media_path = media.add_file(tmp_path, source)
+            downloader['downloaded'] += 1
+            for post_channel, post_id in downloader['pending'].get(source, []):
+                attach_media(post_channel, post_id, source, media_path)
+            if downloader['failed_media'].pop(source, None) is not None:
+                save_failed_media(downloader['failed_media'])
+        except Exception as e:
+            logger.error(f'Ошибка при скачивании {source}: {e}')
+            downloader['failed'] += 1
+            record_failure(downloader, source, channel_name, message_id)
+        finally:
+            downloader['pending'].pop(source, None)
+            queue.task_done()
+
+def start_downloader(client):
+    """Запускает пул задач скачивания медиа."""
+    downloader = {
+        'queue': asyncio.Queue(maxsize=config.MEDIA_QUEUE_SIZE),
+        'pending': {},  # идентификатор фото -> посты (канал, id), ожидающие его скачивания
+        'failed_media': load_failed_media(),
+        'workers': [],
+        'downloaded': 0,
+        'skipped': 0,
+        'failed': 0
+    }
+    for _ in range(max(1, config.MEDIA_DOWNLOAD_WORKERS)):
+        downloader['workers'].append(asyncio.create_task(download_worker(client, downloader)))
+    return downloader
+
+async def enqueue_photo(downloader, photo, channel_name, post_id, message_id, posts=None):
+    """
+    Ставит фото поста в очередь на скачивание. Если то же фото уже в очереди (пересылка
+    в другом канале), повторно оно не скачивается - пост просто получит путь к тому же файлу.
+    message_id - сообщение с фото (для повторной попытки), posts - все ожидающие фото посты.
+    """
+    source = photo_source(photo)
+    posts = posts or [(channel_name, post_id)]
+    if source in downloader['pending']:
+        downloader['pending'][source].extend(post for post in posts if post not in downloader['pending'][source])
+        downloader['skipped'] += 1
+        return
+    downloader['pending'][source] = list(posts)
+    await downloader['queue'].put((photo, source, channel_name, message_id))
+
+async def retry_failed_media(client, cache, downloader):
+    """
+    Повторно ставит в очередь фото, не скачанные в прошлых запусках: сообщения с фото запрашиваются
+    заново (ссылка на файл в старом объекте фото могла устареть). Записи, для которых не осталось
+    ожидающих постов или само сообщение удалено, забываются.
+    """
+    failed_media = downloader['failed_media']
+    by_channel = {}
+    for source, entry in list(failed_media.items()):
+        posts = waiting_posts(source, entry['posts'])
+        if not posts:
+            failed_media.pop(source)
+            continue
+        entry['posts'] = [list(post) for post in posts]
+        by_channel.setdefault(entry['channel'], {})[entry['message_id']] = source
+    if not by_channel:
+        save_failed_media(failed_media)
+        return
+
+    logger.info(f'Повторное скачивание медиа: {sum(len(sources) for sources in by_channel.values())}')
+    media = media_store.get_media_store(config)
+    for channel_name, sources in by_channel.items():
+        try:
+            channel_entity = await entity_cache.resolve_channel(client, cache, channel_name)
+            messages = await rate_limiter.get_limiter('telegram', config).call_async(
+                'history', client.get_messages, channel_entity, ids=list(sources), retry_on=(FloodWaitError,)
+            )
+        except Exception as e:
+            logger.error(f'Не удалось запросить сообщения канала {channel_name} для повторного скачивания: {e}')
+            continue
+        for message_id, message in zip(sources, messages):
+            source = sources[message_id]
+            if message is None or not message.photo or photo_source(message.photo) != source:
+                logger.warning(f'Сообщение {message_id} канала {channel_name} с фото {source} удалено')
+                failed_media.pop(source, None)
+                continue
+            posts = [tuple(post) for post in failed_media[source]['posts']]
+            media_path = media.lookup(source)
+            if media_path is not None:
+                # Фото тем временем скачано для другого канала
+                for post_channel, post_id in posts:
+                    attach_media(post_channel, post_id, source, media_path)
+                failed_media.pop(source, None)
+                continue
+            await enqueue_photo(downloader, message.photo, channel_name, posts[0][1], message_id, posts=posts)
+    save_failed_media(failed_media)
+
+async def stop_downloader(downloader):
+    """Дожидается скачивания всей очереди и останавливает пул."""
+    for _ in downloader['workers']:
+        await downloader['queue'].put(None)
+    await asyncio.gather(*downloader['workers'])
+    logger.info(
+        f'Медиа скачано: {downloader["downloaded"]}, пропущено (уже в хранилище или в очереди): {downloader["skipped"]}, '
+        f'дубликатов по содержимому: {media_store.get_media_store(config).duplicates}, ошибок: {downloader["failed"]}'
+    )
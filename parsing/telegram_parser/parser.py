@@ -2,17 +2,27 @@ import os
 import json
 import logging
 import time
+import asyncio
 from urllib.parse import urlparse
-from telethon.sync import TelegramClient
-from telethon.errors import SessionPasswordNeededError, FloodWaitError
-from datetime import datetime
+from telethon import TelegramClient, events, utils
+from telethon.errors import SessionPasswordNeededError, FloodWaitError, ChannelInvalidError, PeerIdInvalidError
 try:
-    from parsing.telegram_parser import config
+    from parsing.telegram_parser import config, post_index, sync_state, entity_cache, media_downloader
 except ImportError:
     try:
-        from telegram_parser import config
+        from telegram_parser import config, post_index, sync_state, entity_cache, media_downloader
     except ImportError:
         import config
+        import post_index
+        import sync_state
+        import entity_cache
+        import media_downloader
+try:
+    from parsing import scheduler, rate_limiter, storage
+except ImportError:
+    import scheduler
+    import rate_limiter
+    import storage
 
 
 # Настройка логирования (когда скрипт запускается напрямую)
@@ -28,6 +38,12 @@ logger.info('Логгер инициализирован.')
 # Убедитесь, что существует папка для хранения данных
 os.makedirs(config.DATA_FOLDER, exist_ok=True)
 
+# Telethon запрашивает историю канала порциями по 100 сообщений
+HISTORY_CHUNK_SIZE = 100
+
+# Максимальное количество медиа в одном альбоме Telegram
+ALBUM_MAX_SIZE = 10
+
 # Обновляем путь к файлу сессии
 session_file = os.path.join('parsing', 'telegram_parser', 'session_name')
 
@@ -55,49 +71,120 @@ def prompt_credentials(phone_number_needed=True):
         phone_number = None
         return api_id, api_hash, phone_number
 
-def initialize_client(api_id=None, api_hash=None, phone_number=None, proxy=None):
+async def initialize_client(api_id=None, api_hash=None, phone_number=None, proxy=None):
     session_file = os.path.join('parsing', 'telegram_parser', 'session_name')
     # Проверим, существует ли файл сессии
+    # FloodWait не пережидается внутри Telethon, а обрабатывается общим ограничителем запросов
     if os.path.exists(session_file + '.session'):
         logger.info(f'Файл сессии найден: {session_file}')
-        client = TelegramClient(session_file, api_id=api_id, api_hash=api_hash, proxy=proxy)
+        client = TelegramClient(session_file, api_id=api_id, api_hash=api_hash, proxy=proxy, flood_sleep_threshold=0)
     else:
         logger.info('Файл сессии не найден. Запрашиваем данные для создания новой сессии.')
-        client = TelegramClient(session_file, api_id=api_id, api_hash=api_hash, proxy=proxy)
-    client.connect()
+        client = TelegramClient(session_file, api_id=api_id, api_hash=api_hash, proxy=proxy, flood_sleep_threshold=0)
+    await client.connect()
     logger.info('Клиент подключен.')
 
-    if not client.is_user_authorized() and phone_number:
+    if not await client.is_user_authorized() and phone_number:
         logger.info('Клиент не авторизован. Начинается процесс авторизации.')
-        client.send_code_request(phone_number)
+        await client.send_code_request(phone_number)
         try:
-            client.sign_in(phone_number, input('Введите код (придет сообщением в Telegram): '))
+            await client.sign_in(phone_number, input('Введите код (придет сообщением в Telegram): '))
         except SessionPasswordNeededError:
             from getpass import getpass
-            client.sign_in(password=getpass('Введите пароль: '))
+            await client.sign_in(password=getpass('Введите пароль: '))
         logger.info('Аутентификация прошла успешно и сессия была сохранена.')
     else:
         logger.info('Клиент уже авторизован.')
 
     return client
 
-def fetch_channel_messages(client, channel, limit):
+async def produce_pages(client, channel_entity, queue, page_size, **iter_kwargs):
+    """
+    Читает сообщения канала через iter_messages и кладет их в очередь страницами по page_size.
+    Очередь ограничена, поэтому в памяти одновременно находится лишь несколько страниц.
+    """
+    limiter = rate_limiter.get_limiter('telegram', config)
+    page = []
+    received = 0
     try:
-        channel_entity = client.get_entity(channel)
-        # Увеличиваем лимит сообщений для получения большего количества
-        messages = client.get_messages(channel_entity, limit=limit)
-        time.sleep(2)  # Добавляем паузу между запросами
-        return messages
-    except Exception as e:
-        logger.error(f'Ошибка при получении сообщений из канала {channel}: {e}')
-        return []
+        async for message in client.iter_messages(channel_entity, wait_time=0, **iter_kwargs):
+            page.append(message)
+            received += 1
+            # Перед запросом следующей порции истории ждем токен ограничителя
+            if received % HISTORY_CHUNK_SIZE == 0:
+                await limiter.acquire_async('history')
+            if len(page) >= page_size:
+                await queue.put(page)
+                page = []
+        if page:
+            await queue.put(page)
+    except Exception:
+        # Сообщаем получателю о завершении, сама ошибка пробрасывается через задачу
+        await queue.put(None)
+        raise
+    await queue.put(None)
+
+def group_messages(messages):
+    """Группирует сообщения батча в посты: альбомы по grouped_id, остальные сообщения по одному."""
+    albums = {}
+    posts = []
+    for message in messages:
+        if message.grouped_id:
+            if message.grouped_id not in albums:
+                albums[message.grouped_id] = []
+                posts.append(albums[message.grouped_id])
+            albums[message.grouped_id].append(message)
+        else:
+            posts.append([message])
+
+    # Внутри альбома сообщения упорядочены по id (get_messages отдает их от новых к старым)
+    for album in albums.values():
+        album.sort(key=lambda msg: msg.id)
+    return posts, albums
+
+async def complete_boundary_albums(client, messages, albums):
+    """Догружает альбомы, обрезанные границей батча, одним точечным запросом по ids."""
+    if not messages or not albums:
+        return
+
+    batch_ids = [message.id for message in messages]
+    lowest_id, highest_id = min(batch_ids), max(batch_ids)
+    wanted_ids = set()
+    for album in albums.values():
+        if len(album) >= ALBUM_MAX_SIZE:
+            continue
+        album_ids = [message.id for message in album]
+        # id сообщений альбома идут подряд, поэтому недостающие части лежат рядом с границей
+        if min(album_ids) == lowest_id:
+            wanted_ids.update(range(max(album_ids) - ALBUM_MAX_SIZE + 1, min(album_ids)))
+        if max(album_ids) == highest_id:
+            wanted_ids.update(range(max(album_ids) + 1, min(album_ids) + ALBUM_MAX_SIZE))
+
+    wanted_ids = sorted(i for i in wanted_ids.difference(batch_ids) if i > 0)
+    if not wanted_ids:
+        return
+
+    input_chat = await messages[0].get_input_chat()
+    extra_messages = await rate_limiter.get_limiter('telegram', config).call_async(
+        'history', client.get_messages, input_chat, ids=wanted_ids, retry_on=(FloodWaitError,)
+    )
+    for message in extra_messages:
+        if message is not None and message.grouped_id in albums:
+            albums[message.grouped_id].append(message)
+
+    for album in albums.values():
+        album.sort(key=lambda msg: msg.id)
 
-def save_message(client, channel, message, stats):
-    channel_folder = os.path.join(config.DATA_FOLDER, channel.strip('@'))
-    os.makedirs(channel_folder, exist_ok=True)
+async def save_message(client, channel, post_messages, stats, index, downloader):
+    """Сохраняет пост: одиночное сообщение или весь альбом (список сообщений) одной записью хранилища."""
+    channel_name = channel.strip('@')
+    store = storage.get_storage(config)
+
+    # Первое сообщение альбома считается основным: по нему именуется JSON
+    message = post_messages[0]
 
     # Фиксируем текст сообщения, с учетом возможных проблем с экранированием
-    message_text = message.message if message.message else ''
+    message_text = next((msg.message for msg in post_messages if msg.message), '')
     if '/' in message_text:
         message_text = message_text.replace('/', '')
 
@@ -109,7 +196,7 @@ def save_message(client, channel, message, stats):
     message_date = message.date.isoformat() if message.date else ''
     message_views = message.views if hasattr(message, 'views') else 0
     message_forwards = message.forwards if hasattr(message, 'forwards') else 0
-    message_reactions = message.reactions.to_dict() if message.reactions else None
+    message_reactions = next((msg.reactions.to_dict() for msg in post_messages if msg.reactions), None)
 
     # Обновляем статистику (дата самого старого и самого нового поста)
     post_date = message.date
@@ -125,88 +212,364 @@ def save_message(client, channel, message, stats):
         'views': message_views,
         'forwards': message_forwards,
         'reactions': message_reactions,
+        'grouped_id': message.grouped_id,
         'media': []
     }
 
-    media_folder = os.path.join(channel_folder, 'media')
-    os.makedirs(media_folder, exist_ok=True)
-
-    # Проверяем, является ли сообщение частью медиа-альбома (используем grouped_id)
-    if message.grouped_id:
-        # Получаем все сообщения с таким же grouped_id (из альбома)
-        grouped_messages = client.get_messages(channel, limit=50)
-        media_group = [msg for msg in grouped_messages if msg.grouped_id == message.grouped_id]
-
-        # Обрабатываем все сообщения из альбома
-        for msg in media_group:
-            if msg.photo:
-                media_file = f'{msg.id}.jpg'
-                media_path = os.path.join(media_folder, media_file)
-                if not os.path.exists(media_path):
-                    logger.info(f'Скачиваем {media_file}')
-                    print(f'Скачиваем {media_file}')
-                    client.download_media(msg.photo, file=media_path)
-                message_data['media'].append(media_path)
-                stats['media_count'] += 1
-
-            # Объединяем текст, если он есть
-            if msg.message and not message_data['text']:
-                message_data['text'] = msg.message
-
-            # Объединяем реакции, если они есть
-            if msg.reactions and not message_data['reactions']:
-                message_data['reactions'] = msg.reactions.to_dict()
-
-    else:
-        # Если это одиночное сообщение с медиа
-        if message.photo:
-            media_file = f'{message.id}.jpg'
-            media_path = os.path.join(media_folder, media_file)
-            if not os.path.exists(media_path):
-                logger.info(f'Скачиваем {media_file}')
-                print(f'Скачиваем {media_file}')
-                client.download_media(message.photo, file=media_path)
+    # Фото всех сообщений поста (для альбома - всех его частей): уже скачанные берутся из хранилища медиа,
+    # остальные ставятся в очередь после записи поста, а до скачивания в посте стоит идентификатор фото
+    new_photos = []
+    for msg in post_messages:
+        if msg.photo:
+            media_path = media_downloader.stored_photo(downloader, msg.photo)
+            if media_path is None:
+                media_path = media_downloader.photo_source(msg.photo)
+                new_photos.append(msg)
             message_data['media'].append(media_path)
             stats['media_count'] += 1
 
-    # Сохранение информации в JSON файл
-    message_file = os.path.join(channel_folder, f'{message.id}.json')
+    # Проверка на существование других постов с тем же grouped_id или близким временем (по индексу канала)
+    target_id = post_index.find_merge_target(index, message.date, message.grouped_id, exclude_id=message.id)
+    existing_data = store.get_post('telegram', channel_name, target_id) if target_id is not None else None
+    if existing_data is not None:
+        # Убираем дубликаты с сохранением порядка
+        existing_data['media'] = list(dict.fromkeys(existing_data['media'] + message_data['media']))
 
-    # Проверка на существование других сообщений с тем же временем или близким (например, в пределах 3 секунд)
-    json_files = [f for f in os.listdir(channel_folder) if f.endswith('.json')]
-    for json_file in json_files:
-        json_path = os.path.join(channel_folder, json_file)
-        with open(json_path, 'r', encoding='utf-8') as f:
-            existing_data = json.load(f)
+        if not existing_data['text']:
+            existing_data['text'] = message_data['text']
 
-        existing_date = existing_data.get('date', '')
-        time_diff = abs((datetime.fromisoformat(existing_date) - message.date).total_seconds())
+        if not existing_data['reactions']:
+            existing_data['reactions'] = message_data['reactions']
 
-        if (time_diff <= 3 or existing_data.get('grouped_id') == message.grouped_id):
-            existing_data['media'].extend(message_data['media'])
-            existing_data['media'] = list(set(existing_data['media']))  # Убираем дубликаты
+        logger.info(f'Сохраняем {message.id}.json')
+        print(f'Сохраняем {message.id}.json')
+        store.write_post('telegram', channel_name, target_id, existing_data)
+
+        store.delete_post('telegram', channel_name, message.id)
+        post_index.remove_post(index, message.id)
+        if message.grouped_id:
+            index['groups'][str(message.grouped_id)] = target_id
+        for msg in new_photos:
+            await media_downloader.enqueue_photo(downloader, msg.photo, channel_name, target_id, msg.id)
+        return
 
-            if not existing_data['text']:
-                existing_data['text'] = message_data['text']
+    # Пост уже сохранялся (например, повторно получен при догрузке): сохраняем
+    # его дополнительные поля (скоры классификатора и т.п.) и ранее добавленные медиа
+    existing_data = store.get_post('telegram', channel_name, message.id)
+    if existing_data is not None:
+        message_data['media'] = list(dict.fromkeys(existing_data.get('media', []) + message_data['media']))
+        existing_data.update(message_data)
+        message_data = existing_data
 
-            if not existing_data['reactions']:
-                existing_data['reactions'] = message_data['reactions']
+    logger.info(f'Сохраняем {message.id}.json')
+    print(f'Сохраняем {message.id}.json')
+    store.write_post('telegram', channel_name, message.id, message_data)
 
-            with open(json_path, 'w', encoding='utf-8') as f:
-                logger.info(f'Сохраняем {message.id}.json')
-                print(f'Сохраняем {message.id}.json')
-                json.dump(existing_data, f, ensure_ascii=False, indent=4)
+    if not post_index.contains_post(index, message.id, message.date):
+        post_index.add_post(index, message.id, message.date, message.grouped_id)
 
-            if os.path.exists(message_file):
-                os.remove(message_file)
+    for msg in new_photos:
+        await media_downloader.enqueue_photo(downloader, msg.photo, channel_name, message.id, msg.id)
+
+    stats['post_count'] += 1  # Увеличиваем счетчик постов
+
+
+async def save_batch(client, channel, messages, stats, index, state, downloader):
+    """Сохраняет батч сообщений (с объединением альбомов) и сдвигает отметки синхронизации."""
+    posts, albums = group_messages(messages)
+    await complete_boundary_albums(client, messages, albums)
+    for post_messages in posts:
+        await save_message(client, channel, post_messages, stats, index, downloader)
+    sync_state.update_high_water_mark(state, messages)
+    sync_state.save_channel_state(channel, state)
+
+async def stream_channel(client, channel, channel_entity, stats, index, state, downloader, page_size, on_page=None, **iter_kwargs):
+    """
+    Потоковая загрузка канала: страницы сохраняются сразу по мере получения,
+    между загрузкой и сохранением - очередь размером PIPELINE_QUEUE_SIZE страниц.
+    Возвращает количество обработанных сообщений.
+    """
+    queue = asyncio.Queue(maxsize=config.PIPELINE_QUEUE_SIZE)
+    producer = asyncio.create_task(produce_pages(client, channel_entity, queue, page_size, **iter_kwargs))
+    streamed = 0
+    try:
+        while True:
+            page = await queue.get()
+            if page is None:
+                break
+            await save_batch(client, channel, page, stats, index, state, downloader)
+            streamed += len(page)
+            if on_page:
+                on_page(page)
+    except BaseException:
+        producer.cancel()
+        raise
+    # Пробрасываем ошибку загрузки, если она была
+    await producer
+    return streamed
+
+async def sync_channel(client, channel, channel_entity, stats, index, state, downloader):
+    """
+    Загрузка новых сообщений канала. Для нового канала берутся последние POST_LIMIT сообщений,
+    для известного - все сообщения новее last_id, от старых к новым, чтобы отметка last_id
+    сдвигалась монотонно и прерванная загрузка не оставляла разрывов.
+    """
+    async def sync_once():
+        # Отметка last_id перечитывается при каждой попытке: повтор продолжает с сохраненного места
+        if state['last_id']:
+            return await stream_channel(
+                client, channel, channel_entity, stats, index, state, downloader, config.PAGE_SIZE,
+                min_id=state['last_id'], reverse=True
+            )
+        return await stream_channel(
+            client, channel, channel_entity, stats, index, state, downloader, config.PAGE_SIZE,
+            limit=config.POST_LIMIT
+        )
+
+    return await rate_limiter.get_limiter('telegram', config).call_async(
+        'history', sync_once, retry_on=(FloodWaitError,)
+    )
+
+async def backfill_channel(client, channel, channel_entity, stats, index, state, downloader):
+    """
+    Обход истории канала вглубь страницами BACKFILL_PAGE_SIZE, начиная с самого раннего
+    известного сообщения. Курсор сохраняется после каждой страницы, поэтому после сбоя
+    обход продолжается с места остановки.
+    """
+    if state['backfill_done']:
+        return
+
+    def advance_cursor(page):
+        state['backfill_offset_id'] = min(message.id for message in page)
+        sync_state.save_channel_state(channel, state)
+
+    limit = None
+    if config.BACKFILL_MAX_PAGES is not None:
+        limit = config.BACKFILL_PAGE_SIZE * config.BACKFILL_MAX_PAGES
+
+    async def backfill_once():
+        # Курсор перечитывается при каждой попытке: повтор продолжает с сохраненного места
+        return await stream_channel(
+            client, channel, channel_entity, stats, index, state, downloader, config.BACKFILL_PAGE_SIZE,
+            on_page=advance_cursor, offset_id=state['backfill_offset_id'] or state['first_id'], limit=limit
+        )
+
+    streamed = await rate_limiter.get_limiter('telegram', config).call_async(
+        'history', backfill_once, retry_on=(FloodWaitError,)
+    )
+    if limit is None or streamed < limit:
+        state['backfill_done'] = True
+        sync_state.save_channel_state(channel, state)
+        logger.info(f'История канала {channel} полностью загружена.')
+
+def new_channel_stats(channel):
+    """Пустая статистика по каналу."""
+    return {
+        'channel': channel,
+        'post_count': 0,
+        'media_count': 0,
+        'earliest_post': None,
+        'latest_post': None,
+        'duration': 0.0,
+        'error': None
+    }
+
+def log_channel_stats(stats):
+    """Логирование и вывод статистики по каналу."""
+    logger.info(f'Канал: {stats["channel"]}')
+    logger.info(f'Скачано постов: {stats["post_count"]}')
+    logger.info(f'Скачано медиафайлов: {stats["media_count"]}')
+    logger.info(f'Самый ранний пост: {stats["earliest_post"]}')
+    logger.info(f'Самый поздний пост: {stats["latest_post"]}')
+    logger.info(f'Время обработки: {stats["duration"]:.1f} с')
+    if stats['error']:
+        logger.error(f'Ошибка канала {stats["channel"]}: {stats["error"]}')
+
+    # Вывод в консоль (временно для дебага)
+    print(f'Канал: {stats["channel"]}')
+    print(f'Скачано постов: {stats["post_count"]}')
+    print(f'Скачано медиафайлов: {stats["media_count"]}')
+    print(f'Самый ранний пост: {stats["earliest_post"]}')
+    print(f'Самый поздний пост: {stats["latest_post"]}')
+    print(f'Время обработки: {stats["duration"]:.1f} с')
+    if stats['error']:
+        print(f'Ошибка: {stats["error"]}')
+    print('-' * 40)
+
+async def parse_channel(client, channel, semaphore, cache, downloader):
+    """Парсинг одного канала. Ошибки не выходят за пределы канала и попадают в статистику."""
+    stats = new_channel_stats(channel)
+    async with semaphore:
+        logger.info(f'Начало парсинга канала: {channel}')
+        print(f'Начало парсинга канала: {channel}')
+        started = time.monotonic()
+        index = post_index.load_post_index(channel)
+        state = sync_state.load_channel_state(channel)
+        try:
+            channel_entity = await entity_cache.resolve_channel(client, cache, channel)
+            try:
+                await sync_channel(client, channel, channel_entity, stats, index, state, downloader)
+            except (ChannelInvalidError, PeerIdInvalidError, ValueError):
+                # Закэшированный peer устарел: переразрешаем канал и повторяем (прогресс уже сохранен)
+                logger.warning(f'Закэшированный канал {channel} недействителен, переразрешаем.')
+                channel_entity = await entity_cache.resolve_channel(client, cache, channel, refresh=True)
+                await sync_channel(client, channel, channel_entity, stats, index, state, downloader)
+            if config.BACKFILL:
+                await backfill_channel(client, channel, channel_entity, stats, index, state, downloader)
+        except Exception as e:
+            stats['error'] = repr(e)
+        finally:
+            post_index.save_post_index(channel, index)
+        stats['duration'] = time.monotonic() - started
+    log_channel_stats(stats)
+    return stats
+
+async def parse_channels(client, channels):
+    """Конкурентный парсинг списка каналов с ограничением MAX_CONCURRENT_CHANNELS."""
+    cache = entity_cache.load_entity_cache()
+    await entity_cache.resolve_channels(client, cache, channels)
+
+    semaphore = asyncio.Semaphore(max(1, config.MAX_CONCURRENT_CHANNELS))
+    downloader = media_downloader.start_downloader(client)
+    try:
+        await media_downloader.retry_failed_media(client, cache, downloader)
+        tasks = [parse_channel(client, channel, semaphore, cache, downloader) for channel in channels]
+        results = await asyncio.gather(*tasks)
+    finally:
+        await media_downloader.stop_downloader(downloader)
+
+    failed = [stats['channel'] for stats in results if stats['error']]
+    logger.info(f'Обработано каналов: {len(results)}, с ошибками: {len(failed)}')
+    if failed:
+        logger.warning(f'Каналы с ошибками: {", ".join(failed)}')
+    return results
+
+async def save_live_messages(client, context, messages, downloader):
+    """Сохраняет пришедшие в live-режиме сообщения тем же путем, что и при опросе."""
+    posts, _ = group_messages(messages)
+    async with context['lock']:
+        for post_messages in posts:
+            await save_message(client, context['channel'], post_messages, context['stats'], context['index'], downloader)
+        # Отметку last_id сдвигает только догрузка: иначе сообщения, пропущенные во время
+        # разрыва соединения, оказались бы ниже last_id и не были бы догружены
+        post_index.save_post_index(context['channel'], context['index'])
+
+async def catch_up(client, contexts, downloader):
+    """Догрузка опросом всего, что вышло после last_id (при запуске и после переподключения)."""
+    semaphore = asyncio.Semaphore(max(1, config.MAX_CONCURRENT_CHANNELS))
+
+    async def catch_up_channel(context):
+        async with semaphore, context['lock']:
+            try:
+                await sync_channel(
+                    client, context['channel'], context['entity'], context['stats'],
+                    context['index'], context['state'], downloader
+                )
+            except Exception as e:
+                logger.error(f'Ошибка догрузки канала {context["channel"]}: {e}')
+            post_index.save_post_index(context['channel'], context['index'])
+
+    await asyncio.gather(*(catch_up_channel(context) for context in contexts.values()))
+
+async def run_live(client, channels):
+    """
+    Live-режим: подписка на events.NewMessage и events.Album для каналов из списка.
+    Новые посты сохраняются по мере поступления, после каждого переподключения
+    выполняется догрузка опросом.
+    """
+    cache = entity_cache.load_entity_cache()
+    await entity_cache.resolve_channels(client, cache, channels)
+
+    contexts = {}
+    for channel in channels:
+        try:
+            channel_entity = await entity_cache.resolve_channel(client, cache, channel)
+        except Exception as e:
+            logger.error(f'Канал {channel} пропущен в live-режиме: {e}')
+            continue
+        contexts[utils.get_peer_id(channel_entity)] = {
+            'channel': channel,
+            'entity': channel_entity,
+            'stats': new_channel_stats(channel),
+            'index': post_index.load_post_index(channel),
+            'state': sync_state.load_channel_state(channel),
+            'lock': asyncio.Lock()
+        }
+
+    downloader = media_downloader.start_downloader(client)
+    await media_downloader.retry_failed_media(client, cache, downloader)
+    chats = [context['entity'] for context in contexts.values()]
+
+    async def on_new_message(event):
+        # Сообщения альбомов обрабатываются целиком в on_album
+        if event.message.grouped_id or event.chat_id not in contexts:
             return
+        await save_live_messages(client, contexts[event.chat_id], [event.message], downloader)
 
-    with open(message_file, 'w', encoding='utf-8') as f:
-        logger.info(f'Сохраняем {message.id}.json')
-        print(f'Сохраняем {message.id}.json')
-        json.dump(message_data, f, ensure_ascii=False, indent=4)
+    async def on_album(event):
+        if event.chat_id not in contexts:
+            return
+        await save_live_messages(client, contexts[event.chat_id], event.messages, downloader)
 
-    stats['post_count'] += 1  # Увеличиваем счетчик постов
+    client.add_event_handler(on_new_message, events.NewMessage(chats=chats))
+    client.add_event_handler(on_album, events.Album(chats=chats))
+    logger.info(f'Live-режим запущен для каналов: {len(contexts)}')
+    print(f'Live-режим запущен для каналов: {len(contexts)}')
+
+    try:
+        while True:
+            await catch_up(client, contexts, downloader)
+            await client.run_until_disconnected()
+            logger.warning(f'Соединение потеряно. Переподключение через {config.LIVE_RECONNECT_DELAY} секунд.')
+            await asyncio.sleep(config.LIVE_RECONNECT_DELAY)
+            try:
+                await client.connect()
+            except Exception as e:
+                logger.error(f'Не удалось переподключиться: {e}')
+    finally:
+        await media_downloader.stop_downloader(downloader)
+        for context in contexts.values():
+            post_index.save_post_index(context['channel'], context['index'])
+
+async def run_scheduled(client, channels):
+    """Периодический опрос каналов по адаптивному расписанию (см. parsing/scheduler.py)."""
+    cache = entity_cache.load_entity_cache()
+    await entity_cache.resolve_channels(client, cache, channels)
+
+    schedule = scheduler.new_schedule(channels, config)
+    semaphore = asyncio.Semaphore(max(1, config.MAX_CONCURRENT_CHANNELS))
+    downloader = media_downloader.start_downloader(client)
+    try:
+        await media_downloader.retry_failed_media(client, cache, downloader)
+        while True:
+            due = scheduler.pop_due_sources(schedule)
+            if due:
+                results = await asyncio.gather(
+                    *(parse_channel(client, channel, semaphore, cache, downloader) for channel in due)
+                )
+                for stats in results:
+                    requests = 1 + stats['post_count'] // config.PAGE_SIZE
+                    interval = scheduler.record_poll(schedule, stats['channel'], stats, requests=requests)
+                    logger.info(f'Следующий опрос канала {stats["channel"]} через {interval:.0f} секунд')
+                scheduler.save_schedule(schedule)
+
+            delay = scheduler.seconds_until_next(schedule)
+            logger.info(f'Ожидание {delay:.0f} секунд до следующего опроса')
+            await asyncio.sleep(delay)
+    finally:
+        await media_downloader.stop_downloader(downloader)
+
+async def run_parser(api_id, api_hash, phone_number, proxy):
+    """Один проход по всем каналам (или live-режим, или опрос по расписанию) в рамках одного event loop."""
+    client = await initialize_client(api_id, api_hash, phone_number, proxy)
+    try:
+        if config.LIVE_MODE:
+            return await run_live(client, config.TELEGRAM_CHANNELS)
+        if config.SCHEDULE_MODE:
+            return await run_scheduled(client, config.TELEGRAM_CHANNELS)
+        return await parse_channels(client, config.TELEGRAM_CHANNELS)
+    finally:
+        await client.disconnect()
 
 
 def __main__():
@@ -239,38 +602,7 @@ def __main__():
         print('Прокси не используется (Telegram).')
 
     try:
-        client = initialize_client(api_id, api_hash, phone_number, proxy)
-        for channel in config.TELEGRAM_CHANNELS:
-            logger.info(f'Начало парсинга канала: {channel}')
-            print(f'Начало парсинга канала: {channel}') 
-            stats = {
-                'post_count': 0,
-                'media_count': 0,
-                'earliest_post': None,
-                'latest_post': None
-            }
-
-            messages = fetch_channel_messages(client, channel, config.POST_LIMIT)
-            for message in messages:
-                save_message(client, channel, message, stats)
-
-            # Логирование результатов
-            logger.info(f'Канал: {channel}')
-            logger.info(f'Скачано постов: {stats["post_count"]}')
-            logger.info(f'Скачано медиафайлов: {stats["media_count"]}')
-            logger.info(f'Самый ранний пост: {stats["earliest_post"]}')
-            logger.info(f'Самый поздний пост: {stats["latest_post"]}')
-
-            # Вывод в консоль (временно для дебага)
-            print(f'Канал: {channel}')
-            print(f'Скачано постов: {stats["post_count"]}')
-            print(f'Скачано медиафайлов: {stats["media_count"]}')
-            print(f'Самый ранний пост: {stats["earliest_post"]}')
-            print(f'Самый поздний пост: {stats["latest_post"]}')
-            print('-' * 40)
-
-        logger.info(f'Ожидание {config.UPDATE_INTERVAL} секунд до следующего запуска')
-        time.sleep(config.UPDATE_INTERVAL)
+        asyncio.run(run_parser(api_id, api_hash, phone_number, proxy))
 
     except FloodWaitError as e:
         logger.warning(f'Частые запросы. Ожидание {e.seconds} секунд.')
@@ -0,0 +1,100 @@
+import os
+import json
+import bisect
+from datetime import datetime
+try:
+    from parsing.telegram_parser import config
+except ImportError:
+    try:
+        from telegram_parser import config
+    except ImportError:
+        import config
+try:
+    from parsing import storage
+except ImportError:
+    import storage
+
+
+# Индекс сохраненных постов канала: даты (отсортированы), id постов и grouped_id альбомов.
+# Загружается один раз за запуск и обновляется по мере записи постов,
+# чтобы не перечитывать все JSON канала при сохранении каждого сообщения.
+
+def index_path(channel):
+    """Путь к файлу индекса канала."""
+    return os.path.join(config.STATE_FOLDER, f'{channel.strip("@")}_index.json')
+
+def new_post_index():
+    return {'dates': [], 'ids': [], 'groups': {}}
+
+def add_post(index, message_id, date, grouped_id=None):
+    """Добавляет пост в индекс с сохранением сортировки по дате."""
+    timestamp = date.timestamp()
+    position = bisect.bisect_right(index['dates'], timestamp)
+    index['dates'].insert(position, timestamp)
+    index['ids'].insert(position, message_id)
+    if grouped_id:
+        index['groups'][str(grouped_id)] = message_id
+
+def contains_post(index, message_id, date):
+    """Проверяет, есть ли пост в индексе (поиск только среди постов с той же датой)."""
+    timestamp = date.timestamp()
+    left = bisect.bisect_left(index['dates'], timestamp)
+    right = bisect.bisect_right(index['dates'], timestamp)
+    return message_id in index['ids'][left:right]
+
+def remove_post(index, message_id):
+    """Удаляет пост из индекса (например, после слияния с другим постом)."""
+    if message_id in index['ids']:
+        position = index['ids'].index(message_id)
+        del index['dates'][position]
+        del index['ids'][position]
+    for grouped_id, target_id in list(index['groups'].items()):
+        if target_id == message_id:
+            del index['groups'][grouped_id]
+
+def find_merge_target(index, date, grouped_id=None, exclude_id=None):
+    """
+    Ищет пост, с которым нужно объединить новое сообщение: с тем же grouped_id
+    или опубликованный в пределах MERGE_WINDOW секунд. Возвращает id поста или None.
+    """
+    if grouped_id and str(grouped_id) in index['groups']:
+        target_id = index['groups'][str(grouped_id)]
+        if target_id != exclude_id:
+            return target_id
+
+    timestamp = date.timestamp()
+    left = bisect.bisect_left(index['dates'], timestamp - config.MERGE_WINDOW)
+    right = bisect.bisect_right(index['dates'], timestamp + config.MERGE_WINDOW)
+    for message_id in index['ids'][left:right]:
+        if message_id != exclude_id:
+            return message_id
+    return None
+
+def build_post_index(channel):
+    """Строит индекс по уже сохраненным постам канала (однократная миграция существующих данных)."""
+    index = new_post_index()
+    for _, _, post_id, existing_data in storage.get_storage(config).query('telegram', channel.strip('@')):
+        try:
+            message_id = int(post_id)
+            date = datetime.fromisoformat(existing_data['date'])
+        except (ValueError, KeyError):
+            continue
+        add_post(index, message_id, date, existing_data.get('grouped_id'))
+    return index
+
+def load_post_index(channel):
+    """Загружает индекс канала с диска или строит его по сохраненным постам."""
+    path = index_path(channel)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return build_post_index(channel)
+
+def save_post_index(channel, index):
+    """Сохраняет индекс канала (через временный файл, чтобы не оставить его обрезанным)."""
+    os.makedirs(config.STATE_FOLDER, exist_ok=True)
+    path = index_path(channel)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, path)
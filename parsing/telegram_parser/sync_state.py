@@ -0,0 +1,54 @@
+import os
+import json
+try:
+    from parsing.telegram_parser import config
+except ImportError:
+    try:
+        from telegram_parser import config
+    except ImportError:
+        import config
+
+
+# Состояние синхронизации канала: последнее (last_id/last_date) и самое раннее (first_id)
+# из виденных сообщений, а также курсор обхода истории (backfill), чтобы не скачивать
+# уже сохраненное и продолжать обход после сбоя.
+
+def state_path(channel):
+    """Путь к файлу состояния канала."""
+    return os.path.join(config.STATE_FOLDER, f'{channel.strip("@")}_state.json')
+
+def new_channel_state():
+    return {
+        'last_id': 0,
+        'last_date': None,
+        'first_id': 0,
+        'backfill_offset_id': 0,
+        'backfill_done': False
+    }
+
+def load_channel_state(channel):
+    """Загружает состояние канала (или пустое состояние для нового канала)."""
+    state = new_channel_state()
+    path = state_path(channel)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            state.update(json.load(f))
+    return state
+
+def save_channel_state(channel, state):
+    """Сохраняет состояние канала (через временный файл, чтобы не оставить его обрезанным)."""
+    os.makedirs(config.STATE_FOLDER, exist_ok=True)
+    path = state_path(channel)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+def update_high_water_mark(state, messages):
+    """Сдвигает отметки last_id/first_id по сохраненному батчу сообщений."""
+    for message in messages:
+        if message.id > state['last_id']:
+            state['last_id'] = message.id
+            state['last_date'] = message.date.isoformat() if message.date else None
+        if not state['first_id'] or message.id < state['first_id']:
+            state['first_id'] = message.id